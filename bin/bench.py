@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+
+BIN_DIRECTORY= os.path.dirname(os.path.abspath(__file__))
+LIB_DIRECTORY= os.path.join(os.path.dirname(BIN_DIRECTORY), "lib")
+THRESHOLD= 0.2
+
+class Case:
+  """A benchmark of a tool on a synthetic dataset.  The run function calls
+    the tool's functions with the loaded module, open input and output files,
+    and the context; the arguments function returns its command line
+    arguments for the input and output paths and the context."""
+  def __init__(self, name, tool, dataset, run_fn, arguments_fn, row_fraction=1.0):
+    self.name= name
+    self.tool= tool
+    self.dataset= dataset
+    self.run_fn= run_fn
+    self.arguments_fn= arguments_fn
+    self.row_fraction= row_fraction
+
+CSV= {"kind": "csv"}
+CASES= [
+  Case("csvtosvm", "csvtosvm.py", CSV,
+    lambda m, i, o, c: m.doit(i, o, False, 0, 7),
+    lambda i, o, c: [i, o]),
+  Case("csvtosvm-chunks", "csvtosvm.py", CSV,
+    lambda m, i, o, c: m.doit(i, o, False, 0, 7, 1 << 20),
+    lambda i, o, c: ["-c", str(1 << 20), i, o]),
+  Case("csvtosvm-quoted", "csvtosvm.py", {"kind": "csv", "quoting": 0.05},
+    lambda m, i, o, c: m.doit(i, o, False, 0, 7, 1 << 20),
+    lambda i, o, c: ["-c", str(1 << 20), i, o]),
+  Case("svmtocsv", "svmtocsv.py", {"kind": "svm", "sparsity": 0.8},
+    lambda m, i, o, c: m.doit(i, o, c["width"]),
+    lambda i, o, c: ["-f", str(c["width"]), i, o]),
+  Case("scale-save", "scale.py", {"kind": "csv", "coding": 0.05},
+    lambda m, i, o, c: m.save(open(os.devnull, "w"), i, o, "", False, False, block_size=4096),
+    lambda i, o, c: ["-s", os.devnull, "-b", "4096", i, o]),
+  Case("scale-restore", "scale.py", {"kind": "csv", "coding": 0.05},
+    lambda m, i, o, c: m.restore(open(c["settings"]), i, o, False, 4096),
+    lambda i, o, c: ["-r", c["settings"], "-b", "4096", i, o]),
+  Case("normalize", "normalize.py", CSV,
+    lambda m, i, o, c: m.doit(i, o, None, ",", False, False),
+    lambda i, o, c: ["-d", ",", "", i, o]),
+  Case("subset", "subset.py", CSV,
+    lambda m, i, o, c: m.doit("10%", 1, i, o, None),
+    lambda i, o, c: ["-s", "1", i, "10%", o]),
+  Case("subset-reservoir", "subset.py", CSV,
+    lambda m, i, o, c: m.stream("1000", 1, i, o, None),
+    lambda i, o, c: ["-1", "-s", "1", i, "1000", o]),
+  Case("lor", "lor.py", {"kind": "csv", "sparsity": 0.5},
+    lambda m, i, o, c: m.doit(i, o, 1.0, True),
+    lambda i, o, c: ["-n", "1", i, o], 0.25),
+  Case("plot-lines", "plot-lines.py", CSV,
+    lambda m, i, o, c: m.doit(i, o, "1-4", ",", False, None, None, 1000, "min-max", True),
+    lambda i, o, c: ["-g", "-m", "1000", "-d", ",", "1-4", i, o]),
+  Case("plot-bar", "plot-bar.py", CSV,
+    lambda m, i, o, c: m.doit(i, o, False, False, None, c["width"] + 1, "1-4", None, "mean", True),
+    lambda i, o, c: ["-g", "-a", "mean", "-l", str(c["width"] + 1), "-c", "1-4", i, o]),
+]
+
+def load_tool(tool):
+  # Load a script in bin as a module without running its main code.
+  import importlib.util
+  spec= importlib.util.spec_from_file_location(tool[:-3].replace("-", "_"), os.path.join(BIN_DIRECTORY, tool))
+  module= importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module)
+  return module
+
+def run_cli(argv):
+  # Run a command with its standard input and output discarded and return
+  # its elapsed time and peak resident set size, raising RuntimeError if it
+  # fails.
+  import time
+  start= time.perf_counter()
+  pid= os.fork()
+  if pid == 0:
+    try:
+      fd= os.open(os.devnull, os.O_RDWR)
+      for target in (0, 1):
+        os.dup2(fd, target)
+      os.execv(argv[0], argv)
+    finally:
+      os._exit(127)
+  _, status, usage= os.wait4(pid, 0)
+  elapsed= time.perf_counter() - start
+  status= os.waitstatus_to_exitcode(status)
+  if status:
+    raise RuntimeError("{} failed with status {}".format(" ".join(argv), status))
+  return elapsed, usage.ru_maxrss
+
+def run_in_process(case, module, input_path, context):
+  with open(input_path) as fin, open(os.devnull, "w") as fout:
+    case.run_fn(module, fin, fout, context)
+    fout.flush()
+
+def doit(names, row_count, column_count, seed, modes, repeat_count, history_path, threshold, wants_saving):
+  import datetime
+  import platform
+  import tempfile
+  from benchmark import load_history, measure, regressions, report, save_history
+  from synthetic import write_dataset
+  import numpy
+  import scipy.optimize
+  cases= [case for case in CASES if not names or case.name in names or case.tool[:-3] in names]
+  results= {}
+  with tempfile.TemporaryDirectory() as directory:
+    context= {"width": column_count}
+    paths= {}
+    for case in cases:
+      # Generate each dataset once.
+      rows= max(1, int(row_count * case.row_fraction))
+      dataset_key= tuple(sorted(case.dataset.items())) + (rows,)
+      if dataset_key not in paths:
+        path= os.path.join(directory, "dataset{}.{}".format(len(paths), case.dataset["kind"]))
+        write_dataset(path, row_count=rows, column_count=column_count, seed=seed, **case.dataset)
+        paths[dataset_key]= path
+      input_path= paths[dataset_key]
+      size= os.path.getsize(input_path)
+      module= load_tool(case.tool)
+      if case.tool == "scale.py" and "settings" not in context:
+        context["settings"]= os.path.join(directory, "settings")
+        with open(context["settings"], "w") as fout, open(input_path) as fin, open(os.devnull, "w") as fnull:
+          module.save(fout, fin, fnull, "", False, False, block_size=4096)
+      for mode in modes:
+        if mode == "cli":
+          argv= [sys.executable, os.path.join(BIN_DIRECTORY, case.tool)] + case.arguments_fn(input_path, os.devnull, context)
+          runs= [run_cli(argv) for _ in range(repeat_count)]
+        else:
+          runs= [measure(run_in_process, case, module, input_path, context) for _ in range(repeat_count)]
+        elapsed, peak_rss= min(runs)
+        key= "{} {} rows={} width={} seed={}".format(case.name, mode, rows, column_count, seed)
+        results[key]= {"rows_per_second": rows / elapsed, "mb_per_second": size / elapsed / 1e6, "peak_rss_kb": peak_rss}
+        report("{} {}".format(case.name, mode), elapsed, peak_rss, rows_per_second=int(rows / elapsed), mb_per_second=round(size / elapsed / 1e6, 2))
+
+  # Compare the results with the history and record them.
+  history= load_history(history_path)
+  found= regressions(history, results, threshold)
+  for key, metric, value, baseline in found:
+    print("regression:  {} {} {:.6g} (baseline {:.6g})".format(key, metric, value, baseline), file=sys.stderr)
+  if wants_saving:
+    history.append({"time": datetime.datetime.now().isoformat(timespec="seconds"), "host": platform.node(),
+      "python": platform.python_version(), "results": results})
+    save_history(history_path, history)
+  return not found
+
+if __name__ == "__main__":
+  sys.path.insert(0, LIB_DIRECTORY)
+  parser= argparse.ArgumentParser(description="Benchmarks the data tools on synthetic datasets.",
+    epilog="""Each case generates a seeded dataset varying its rows, width,
+    sparsity, quoting, and erf-coded values and runs a tool on it, both in
+    this process (in a forked child, after importing NumPy and SciPy) and
+    from the command line.  It records rows and megabytes per second and peak
+    resident set size to the history file and reports results worse than the
+    median of the last five runs with the same parameters by more than the
+    threshold fraction, exiting with status one if there are any.  Cases and
+    tools are named by the positional arguments (default all).""")
+  parser.add_argument("-r", "--rows", type=int, default=20000,
+    help="the number of rows in the datasets (default %(default)s)")
+  parser.add_argument("-w", "--width", type=int, default=20,
+    help="the number of feature columns in the datasets (default %(default)s)")
+  parser.add_argument("-s", "--seed", type=int, default=1,
+    help="the random seed of the datasets (default %(default)s)")
+  parser.add_argument("-m", "--mode", choices=["in-process", "cli"], action="append",
+    help="run only in this mode (default both)")
+  parser.add_argument("-n", "--repeat", metavar="N", type=int, default=1,
+    help="the number of runs of each case, keeping the fastest (default %(default)s)")
+  parser.add_argument("-H", "--history", metavar="PATH",
+    default=os.path.join(os.path.expanduser("~"), ".cache", "benchmark-history.json"),
+    help="the JSON history file (default %(default)s)")
+  parser.add_argument("-t", "--threshold", type=float, default=THRESHOLD,
+    help="the fraction worse than the history that is a regression (default %(default)s)")
+  parser.add_argument("-N", "--no-save", action="store_true",
+    help="compare with the history without recording the results")
+  parser.add_argument("-l", "--list", action="store_true",
+    help="list the cases")
+  parser.add_argument("names", nargs="*",
+    help="the cases or tools to run")
+  args= parser.parse_args()
+  if args.list:
+    for case in CASES:
+      print(case.name, case.tool, case.dataset)
+    exit(0)
+  os.environ["PYTHONPATH"]= os.pathsep.join(p for p in (LIB_DIRECTORY, os.environ.get("PYTHONPATH")) if p)
+  os.makedirs(os.path.dirname(os.path.abspath(args.history)), exist_ok=True)
+  if not doit(args.names, args.rows, args.width, args.seed, args.mode or ["in-process", "cli"], args.repeat, args.history, args.threshold, not args.no_save):
+    exit(1)
@@ -4,51 +4,190 @@ import argparse
 import io
 import sys
 
-def doit(input_file, output_file, ignore_first_line, target_column, ndigits):
+CHUNK_SIZE = 4 << 20
+
+def add_bad_data(bad_data, line_number):
+  if len(bad_data) < 33:
+    bad_data.add(line_number)
+  elif len(bad_data) == 33:
+    bad_data.add("...")
+
+def convert_line(line, target_index, fmt, bad_data, line_number):
   from quoted_line import parse as parse_line
-  target_index = target_column - 1 if target_column >= 0 else target_column
-  fmt= "%%.%dg" % ndigits
-  if ignore_first_line:
-    next(input_file)
-    line_offset = 2
-  else:
-    line_offset = 1
+  parts = parse_line(line, ',')
+  output_line = parts[target_index]
+  parts = parts[:target_index] + parts[target_index + 1:]
+  for i, part in enumerate(s.strip() for s in parts):
+    try:
+      value= fmt % float(part)
+      if value != "0":
+        output_line += " {}:{}".format(i + 1, value)
+    except ValueError:
+      add_bad_data(bad_data, line_number)
+  return output_line
+
+def convert_block(lines, target_index, fmt):
+  # Convert lines without quotes that all have the same number of parts at
+  # once.  Return None if they don't or if any part is not a number.
+  import numpy as np
+  rows = [line.strip().split(',') for line in lines if ',' in line]
+  if not rows or any(len(row) != len(rows[0]) for row in rows) or any('"' in line for line in lines):
+    return None
+  targets = [row.pop(target_index) for row in rows]
+  width = len(rows[0])
+  try:
+    values = np.fromiter(map(float, (part for row in rows for part in row)), float, len(rows) * width)
+  except ValueError:
+    return None
+  values = values.reshape(len(rows), width)
+
+  # Format only the nonzero values, including negative zero since it doesn't
+  # format as "0".
+  mask = (values != 0) | np.signbit(values)
+  row_indices, column_indices = np.nonzero(mask)
+  pairs = np.empty(2 * len(row_indices), dtype=object)
+  pairs[0::2] = (column_indices + 1).tolist()
+  pairs[1::2] = values[mask].tolist()
+  entries = ((" %d:" + fmt + "\n") * len(row_indices) % tuple(pairs)).split("\n")
+  ends = np.cumsum(mask.sum(axis=1)).tolist()
+  output = []
+  g = iter(zip(targets, [0] + ends, ends))
+  for line in lines:
+    if ',' in line:
+      target, start, end = next(g)
+      output.append(target + "".join(entries[start:end]))
+    else:
+      output.append("")
+  output.append("")
+  return "\n".join(output)
+
+def convert_chunk(args):
+  chunk, line_number, target_index, fmt = args
+  lines = chunk.decode().split('\n')
+  if lines[-1] == "":
+    lines.pop()
+  output = convert_block(lines, target_index, fmt)
   bad_data = set()
-  for line_index, line in enumerate(input_file):
+  if output is None:
+    output = io.StringIO()
+    for line_index, line in enumerate(lines):
+      if ',' in line:
+        print(convert_line(line, target_index, fmt, bad_data, line_index + line_number), file=output)
+      else:
+        print(file=output)
+    output = output.getvalue()
+  return output, bad_data
+
+def find_target_index(chunk):
+  from quoted_line import parse as parse_line
+  for line in chunk.decode().split('\n'):
     if ',' in line:
-      parts = parse_line(line, ',')
+      return len(parse_line(line, ',')) - 1
+  return -1
+
+def convert_chunks(input_file, output_file, target_index, fmt, line_offset, chunk_size, jobs):
+  # Convert chunks of the input in order, either here or in a pool of
+  # processes with a bounded number of outstanding chunks.
+  import collections
+  from quoted_line import read_chunks
+  bad_data = set()
+  def tasks():
+    nonlocal target_index
+    line_number = line_offset
+    for chunk in read_chunks(input_file, chunk_size):
       if target_index < 0:
-        target_index = len(parts) - 1
-      output_line = parts[target_index]
-      parts = parts[:target_index] + parts[target_index + 1:]
-      for i, part in enumerate(s.strip() for s in parts):
-        try:
-          value= fmt % float(part)
-          if value != "0":
-            output_line += " {}:{}".format(i + 1, value)
-        except ValueError:
-          if len(bad_data) < 33:
-            bad_data.add(line_index + line_offset)
-          elif len(bad_data) == 33:
-            bad_data.add("...")
-      print(output_line, file=output_file)
+        target_index = find_target_index(chunk)
+      yield chunk, line_number, target_index, fmt
+      line_number += chunk.count(b'\n')
+  def write(result):
+    output, chunk_bad_data = result
+    output_file.write(output)
+    for line_number in sorted(chunk_bad_data, key=lambda e: float("inf" if e == "..." else e)):
+      add_bad_data(bad_data, line_number)
+  if jobs > 1:
+    import multiprocessing
+    with multiprocessing.Pool(jobs) as pool:
+      pending = collections.deque()
+      for task in tasks():
+        pending.append(pool.apply_async(convert_chunk, (task,)))
+        if len(pending) >= 2 * jobs:
+          write(pending.popleft().get())
+      while pending:
+        write(pending.popleft().get())
+  else:
+    for task in tasks():
+      write(convert_chunk(task))
+  return bad_data
+
+def doit(input_file, output_file, ignore_first_line, target_column, ndigits, chunk_size=0, jobs=1, wants_cache=False, wants_binary=False):
+  target_index = target_column - 1 if target_column >= 0 else target_column
+  fmt= "%%.%dg" % ndigits
+
+  # Use a binary dataset if given one or asked to write one, caching the
+  # input if asked.  Convert CSV text to LIBSVM text directly since a dataset
+  # does not keep the text of the targets or the lines without a comma.
+  import dataset
+  def read(f):
+    return dataset.read_csv(f, max(target_index, -1), ignore_first_line)
+  key = "csv:%d:%d" % (max(target_index, -1), ignore_first_line)
+  d = dataset.open_input(input_file, key, read, wants_cache and wants_binary)
+  if d is None and wants_binary:
+    d = read(input_file)
+  if d is not None:
+    if wants_binary:
+      dataset.write_output(d, output_file)
+    else:
+      dataset.write_svm(d, output_file, fmt)
+    return dataset.report_bad_lines(d)
+
+  if chunk_size or jobs > 1:
+    input_file = input_file.buffer if hasattr(input_file, "buffer") else input_file
+    if ignore_first_line:
+      input_file.readline()
+    bad_data = convert_chunks(input_file, output_file, target_index, fmt, 2 if ignore_first_line else 1, chunk_size or CHUNK_SIZE, jobs)
+  else:
+    if ignore_first_line:
+      next(input_file)
+      line_offset = 2
     else:
-      print(file=output_file)
+      line_offset = 1
+    bad_data = set()
+    for line_index, line in enumerate(input_file):
+      if ',' in line:
+        if target_index < 0:
+          from quoted_line import parse as parse_line
+          target_index = len(parse_line(line, ',')) - 1
+        print(convert_line(line, target_index, fmt, bad_data, line_index + line_offset), file=output_file)
+      else:
+        print(file=output_file)
   if bad_data:
     l= sorted(bad_data, key=lambda e: float("inf" if e == "..." else e))
-    print("warning:  bad data in lines " + ", ".join(l), file=sys.stderr)
+    print("warning:  bad data in lines " + ", ".join(map(str, l)), file=sys.stderr)
   return not bad_data
 
 if __name__ == "__main__":
   parser = argparse.ArgumentParser(description="""Converts CSV data to LIBSVM
     data.""", epilog="""You may specify either a positive or negative target
-    column.""")
+    column.  Specifying either the chunk size or jobs option converts chunks
+    of lines at a time, using NumPy for chunks without quotes or bad data.
+    The input may be a binary dataset.  The cache option applies only to
+    binary output; LIBSVM output keeps the text of the targets, so it is
+    always converted from the CSV text.  Cached datasets are stored in
+    $DATASET_CACHE (default ~/.cache/dataset).""")
   parser.add_argument("-i", "--ignore-first-line", action="store_true",
     help="ignore the first line")
   parser.add_argument("-p", "--precision", default=7, type=int,
     help="number of significant figures (default %(default)s)")
   parser.add_argument("-t", "--target", type=int, default=0,
     help="specify the column containing the target (default last column)")
+  parser.add_argument("-c", "--chunk-size", metavar="BYTES", type=int, default=0,
+    help="convert chunks of about this many bytes at a time (default %d with jobs)" % CHUNK_SIZE)
+  parser.add_argument("-j", "--jobs", metavar="N", type=int, default=1,
+    help="the number of processes converting chunks (default %(default)s)")
+  parser.add_argument("-C", "--cache", action="store_true",
+    help="cache the parsed input file as a binary dataset for binary output")
+  parser.add_argument("-b", "--binary", action="store_true",
+    help="write a binary dataset instead of LIBSVM data")
   parser.add_argument("input_file", nargs="?",
     type=argparse.FileType("r"), default=sys.stdin,
     help="input CSV file (default standard input)")
@@ -56,5 +195,5 @@ if __name__ == "__main__":
     type=argparse.FileType("w"), default=sys.stdout,
     help="output SVM file (default standard output)")
   args = parser.parse_args()
-  if not doit(args.input_file, args.output_file, args.ignore_first_line, args.target, args.precision):
+  if not doit(args.input_file, args.output_file, args.ignore_first_line, args.target, args.precision, args.chunk_size, args.jobs, args.cache, args.binary):
     exit(1)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import sys
+import time
+import csvtosvm
+import daemoner
+import scale
+
+CHUNK_SIZE= 4 << 20
+
+class Manifest:
+  """Records for each shard its size and modification time when last seen,
+    the offset of the first byte not yet converted, the number of lines
+    before it, and the size of the output at that offset."""
+  def __init__(self, path):
+    self.path= path
+    try:
+      with open(path) as fin:
+        self.entries= json.load(fin)
+    except FileNotFoundError:
+      self.entries= {}
+
+  def commit(self):
+    # Replace the file so a restart sees either the old or the new entries.
+    temporary_path= self.path + ".tmp"
+    with open(temporary_path, "w") as fout:
+      json.dump(self.entries, fout, indent=1, sort_keys=True)
+      fout.flush()
+      os.fsync(fout.fileno())
+    os.replace(temporary_path, self.path)
+
+class Ingester:
+  """Scales and converts the lines of the CSV shards in a spool directory to
+    LIBSVM files in an output directory, continuing each shard from the
+    offset in the manifest."""
+  def __init__(self, spool_directory, output_directory, settings_file, manifest_path, wants_clamping, has_header, target_column, ndigits, chunk_size=CHUNK_SIZE, suffix=".csv"):
+    self.spool_directory= spool_directory
+    self.output_directory= output_directory
+    self.min_max_dict= scale.read_settings(settings_file, wants_clamping)
+    self.manifest= Manifest(manifest_path)
+    self.has_header= has_header
+    self.target_column= target_column
+    self.fmt= "%%.%dg" % ndigits
+    self.chunk_size= chunk_size
+    self.suffix= suffix
+
+  def poll(self):
+    """Converts the new lines of new and changed shards in order of
+      modification time."""
+    shards= []
+    for entry in os.scandir(self.spool_directory):
+      if entry.name.endswith(self.suffix) and entry.is_file():
+        shards.append((entry.stat().st_mtime_ns, entry.name))
+    for _, name in sorted(shards):
+      self.update(name)
+
+  def update(self, name):
+    try:
+      st= os.stat(os.path.join(self.spool_directory, name))
+    except FileNotFoundError:
+      return
+    entry= self.manifest.entries.get(name)
+    is_unchanged= entry is not None and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime_ns
+    if is_unchanged and (entry["offset"] == st.st_size or "error" in entry):
+      return
+    if entry is None or "error" in entry or st.st_size < entry["offset"] or (entry["size"] == st.st_size and not is_unchanged):
+      # Start over with new, shrunken, rewritten, or changed quarantined
+      # shards.
+      entry= {"offset": 0, "line_count": 0, "output_size": 0}
+    entry["size"], entry["mtime"]= st.st_size, st.st_mtime_ns
+    self.manifest.entries[name]= entry
+
+    # Convert only whole lines unless the shard has not changed since the
+    # last poll, in which case its last line is also complete.
+    # Quarantine a shard that fails so the others still progress, recording
+    # the error in the manifest.
+    try:
+      self.convert(name, entry, is_unchanged)
+    except Exception as ex:
+      entry["error"]= "{}: {}".format(type(ex).__name__, ex)
+      print("error:  quarantining {}: {}".format(name, entry["error"]), file=sys.stderr)
+    self.manifest.commit()
+
+  def convert(self, name, entry, wants_last_line):
+    input_path= os.path.join(self.spool_directory, name)
+    output_path= os.path.join(self.output_directory, os.path.splitext(name)[0] + ".svm")
+    with open(input_path, "rb") as fin, open(output_path, "ab") as fout:
+      # Discard output beyond the offset, such as from an interrupted chunk.
+      fout.truncate(entry["output_size"])
+      fout.seek(entry["output_size"])
+      fin.seek(entry["offset"])
+      while True:
+        lines= fin.readlines(self.chunk_size)
+        if lines and not lines[-1].endswith(b"\n") and not wants_last_line:
+          lines.pop()
+        if not lines:
+          break
+        line_number= entry["line_count"] + 1
+        offset= entry["offset"] + sum(map(len, lines))
+        line_count= entry["line_count"] + len(lines)
+        if self.has_header and line_number == 1:
+          lines.pop(0)
+          line_number += 1
+        if lines:
+          fout.write(self.convert_lines(name, lines, line_number).encode())
+          fout.flush()
+          os.fsync(fout.fileno())
+        entry["offset"], entry["line_count"], entry["output_size"]= offset, line_count, fout.tell()
+        self.manifest.commit()
+
+  def convert_lines(self, name, lines, line_number):
+    # Scale and convert the lines at once or, if any of them cannot be, one
+    # at a time, dropping and reporting those that cannot.
+    try:
+      output, bad_data= self.scale_and_convert(lines, line_number)
+    except (ValueError, IndexError):
+      outputs= []
+      bad_data= set()
+      bad_lines= set()
+      for number, line in enumerate(lines, line_number):
+        try:
+          output, line_bad_data= self.scale_and_convert([line], number)
+          outputs.append(output)
+          for e in line_bad_data:
+            csvtosvm.add_bad_data(bad_data, e)
+        except (ValueError, IndexError):
+          csvtosvm.add_bad_data(bad_lines, number)
+      print("warning:  cannot convert {} lines {}".format(name, format_line_numbers(bad_lines)), file=sys.stderr)
+      output= "".join(outputs)
+    if bad_data:
+      print("warning:  bad data in {} lines {}".format(name, format_line_numbers(bad_data)), file=sys.stderr)
+    return output
+
+  def scale_and_convert(self, lines, line_number):
+    text= scale.normalize_block(self.min_max_dict, [line.decode() for line in lines])
+    chunk= text.encode()
+    if self.target_column > 0:
+      target_index= self.target_column - 1
+    else:
+      target_index= csvtosvm.find_target_index(chunk) + (self.target_column + 1 if self.target_column else 0)
+    return csvtosvm.convert_chunk((chunk, line_number, target_index, self.fmt))
+
+def format_line_numbers(line_numbers):
+  return ", ".join(map(str, sorted(line_numbers, key=lambda e: float("inf" if e == "..." else e))))
+
+def run(args):
+  with open(args.settings_file) as fin:
+    ingester= Ingester(args.spool_directory, args.output_directory, fin, args.manifest or os.path.join(args.output_directory, "manifest.json"), args.clamp, args.ignore_first_line, args.target, args.precision, args.chunk_size, args.suffix)
+  ingester.poll()
+  while args.action != "once":
+    time.sleep(args.interval)
+    ingester.poll()
+
+if __name__ == "__main__":
+  parser= argparse.ArgumentParser(description="""Scales and converts CSV shards
+    arriving in a spool directory to LIBSVM files.""", epilog="""The daemon
+    polls the spool directory for new and changed shards with the suffix,
+    scales their new lines with the settings file from scale.py, and converts
+    them as csvtosvm.py does to a file with the same name and an .svm suffix
+    in the output directory.  The manifest (default manifest.json in the
+    output directory) records the size, modification time, and converted
+    offset of each shard, so a restarted daemon resumes each shard where it
+    stopped.  It converts only whole lines until a shard stops changing.  The
+    once action converts the spool directory once without becoming a daemon.
+    The PID file is ingest.pid in the output directory.""")
+  parser.add_argument("-r", "--restore", metavar="settings_file", dest="settings_file",
+    type=os.path.abspath, required=True,
+    help="the scaling parameter settings file")
+  parser.add_argument("-c", "--clamp", action="store_true",
+    help="ensure scaled values are within range")
+  parser.add_argument("-i", "--ignore-first-line", action="store_true",
+    help="ignore the first line of each shard")
+  parser.add_argument("-p", "--precision", default=7, type=int,
+    help="number of significant figures (default %(default)s)")
+  parser.add_argument("-t", "--target", type=int, default=0,
+    help="specify the column containing the target (default last column)")
+  parser.add_argument("-m", "--manifest", metavar="PATH", type=os.path.abspath,
+    help="the manifest file")
+  parser.add_argument("-x", "--suffix", default=".csv",
+    help="the suffix of shard file names (default %(default)s)")
+  parser.add_argument("-n", "--interval", metavar="SECONDS", type=float, default=10,
+    help="the time between polls (default %(default)s)")
+  parser.add_argument("-k", "--chunk-size", metavar="BYTES", type=int, default=CHUNK_SIZE,
+    help="convert and commit about this many bytes at a time (default %(default)s)")
+  parser.add_argument("-e", "--error-file", metavar="PATH", type=os.path.abspath, default="/dev/null",
+    help="the daemon's standard error file (default %(default)s)")
+  parser.add_argument("action", choices=["start", "stop", "once"],
+    help="start or stop the daemon or convert once")
+  parser.add_argument("spool_directory", type=os.path.abspath,
+    help="the directory of CSV shards")
+  parser.add_argument("output_directory", type=os.path.abspath,
+    help="the directory for the LIBSVM files")
+  args= parser.parse_args()
+  os.makedirs(args.output_directory, exist_ok=True)
+  pid_file_path= os.path.join(args.output_directory, "ingest.pid")
+  if args.action == "start":
+    parameters= daemoner.DaemonParameters()
+    parameters.error_file_path= args.error_file
+    parameters.sigterm_fn= lambda: print("stopping", file=sys.stderr)
+    daemoner.start(pid_file_path, run, args, parameters)
+  elif args.action == "stop":
+    if not daemoner.stop(pid_file_path):
+      print("Daemon ingest not running", file=sys.stderr)
+      sys.exit(1)
+  else:
+    run(args)
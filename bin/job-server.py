@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+import daemoner
+from jobserver import default_socket_path, serve, WORKER_COUNT
+
+if __name__ == "__main__":
+  if "--benchmark" in sys.argv:
+    from jobserver import benchmark
+    benchmark()
+    exit(0)
+  parser= argparse.ArgumentParser(description="Controls the job server daemon.",
+    epilog="""The job server imports numpy, scipy, and pygal once and runs the
+    scripts in bin for job.py in a pool of forked workers.""")
+  parser.add_argument("-s", "--socket", metavar="PATH", type=os.path.abspath,
+    default=default_socket_path(), help="the job server socket (default %(default)s)")
+  parser.add_argument("-w", "--workers", metavar="N", type=int, default=WORKER_COUNT,
+    help="the number of waiting workers (default %(default)s)")
+  tools_directory= os.path.dirname(os.path.abspath(__file__))
+  def run(args):
+    serve(args.socket, tools_directory, args.workers)
+  daemoner.main("job-server", run, daemoner.DaemonParameters(), parser)
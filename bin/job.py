@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+from jobserver import default_socket_path, submit
+
+if __name__ == "__main__":
+  parser= argparse.ArgumentParser(description="Runs a script in bin with the job server.",
+    epilog="""The script uses this process's standard input, output, and error,
+    working directory, umask, and environment.  If the job server is not
+    running, the script runs directly instead.""")
+  parser.add_argument("-s", "--socket", metavar="PATH", default=default_socket_path(),
+    help="the job server socket (default %(default)s)")
+  parser.add_argument("tool",
+    help="the name of the script, such as lor.py")
+  parser.add_argument("args", nargs=argparse.REMAINDER,
+    help="the arguments of the script")
+  args= parser.parse_args()
+  try:
+    exit_code= submit(args.socket, args.tool, args.args)
+  except (ConnectionRefusedError, FileNotFoundError):
+    path= os.path.join(os.path.dirname(os.path.abspath(__file__)), args.tool)
+    os.execv(sys.executable, [sys.executable, path] + args.args)
+  sys.exit(exit_code)
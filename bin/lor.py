@@ -2,9 +2,11 @@
 
 import argparse
 import itertools as it
-import numpy as np
-import scipy.optimize as sop
 import sys
+from lazy import LazyModule
+
+np= LazyModule("numpy")
+sop= LazyModule("scipy.optimize")
 
 def as_bools(*t):
 	if len(t) == 1 and "__iter__" in dir(t[0]):
@@ -17,12 +19,22 @@ class Model:
 		return " ".join(map(str, self.theta.flat))
 
 	def apply(self, x):
-		# Add a bias column to x and multiply it by the model.
-		x1= np.hstack((np.ones((x.shape[0], 1)), x))
-		return np.dot(x1, self.theta)
+		# Multiply x by the model, adding the bias term instead of a bias
+		# column.
+		return np.dot(x, self.theta[1:]) + self.theta[0]
 
 class MinimizedModel(Model):
+	def __init__(self, x, y, l, m, s, solver="lbfgs", tolerance=1e-5, max_iterations=None):
+		# Minimize a regularized cost function of x onto y, adding the bias
+		# term instead of a bias column.
+		theta= fit(((x, y),), x.shape[1], l, solver, tolerance, max_iterations)
+		theta[0] -= np.sum(theta[1:] * m / s)
+		theta[1:] /= s
+		self.theta= theta
+
+class OriginalModel(Model):
 	def __init__(self, x, y, l, m, s):
+		# This is the original implementation, kept for comparison.
 		# Add a bias column to x and minimize a regularized cost function
 		# of x onto y.
 		def sigmoid(x, theta):
@@ -47,21 +59,220 @@ class MinimizedModel(Model):
 		theta[1:] /= s
 		self.theta= theta
 
-def doit(input_file, output_file, regularization, wants_normalization):
-	# Read the entire file.
-	data= tuple(tuple(map(float, line.split(','))) for line in input_file)
-	if len(data) == 0:
+class Chunks:
+	# Reads chunks of rows of (possibly memory-mapped or sparse) features and
+	# targets, normalizing the features of each chunk as it goes.  Sparse
+	# features are only scaled so they remain sparse.
+	def __init__(self, x, y, chunk_rows, mu=None, sigma=None):
+		self.x= x
+		self.y= y
+		self.chunk_rows= chunk_rows
+		self.mu= mu
+		self.sigma= sigma
+
+	def __len__(self):
+		return len(self.y)
+
+	def __iter__(self):
+		return self.read()
+
+	def read(self, rng=None):
+		# Read the chunks in order or, given a random number generator, in a
+		# random order.
+		starts= np.arange(0, len(self.y), self.chunk_rows)
+		if rng is not None:
+			rng.shuffle(starts)
+		import scipy.sparse as sps
+		is_sparse= sps.issparse(self.x)
+		for i in starts.tolist():
+			if is_sparse:
+				x= self.x[i:i + self.chunk_rows]
+				if self.sigma is not None:
+					x= x @ sps.diags(1 / self.sigma)
+			else:
+				x= np.asarray(self.x[i:i + self.chunk_rows], dtype=float)
+				if self.sigma is not None:
+					x= (x - self.mu) / self.sigma
+			yield x, np.asarray(self.y[i:i + self.chunk_rows], dtype=float)
+
+	def moments(self):
+		# Compute the mean and standard deviation of each feature by merging
+		# those of the chunks.
+		import scipy.sparse as sps
+		if sps.issparse(self.x):
+			# Sum the values and their squares, which keeps the chunks sparse.
+			s1, s2= 0.0, 0.0
+			for x, _ in self:
+				s1= s1 + np.asarray(x.sum(0)).ravel()
+				s2= s2 + np.asarray(x.multiply(x).sum(0)).ravel()
+			mean= s1 / len(self)
+			return mean, np.sqrt(np.maximum(s2 / len(self) - mean ** 2, 0.0))
+		n, mean, m2= 0, 0.0, 0.0
+		for x, _ in self:
+			k= len(x)
+			chunk_mean= x.mean(0)
+			delta= chunk_mean - mean
+			mean= mean + delta * k / (n + k)
+			m2= m2 + ((x - chunk_mean) ** 2).sum(0) + delta ** 2 * n * k / (n + k)
+			n += k
+		return mean, np.sqrt(m2 / n)
+
+def as_sparse(d):
+	import scipy.sparse as sps
+	return sps.csr_matrix((d.data, d.indices, d.indptr), shape=(len(d), d.column_count))
+
+def map_input(input_file, chunk_rows, is_libsvm=False, wants_cache=False):
+	# Return memory-mapped features and targets, parsing the input into a
+	# temporary file a chunk at a time unless it is a binary dataset.  Return
+	# sparse features for LIBSVM input.
+	import dataset
+	import tempfile
+	if is_libsvm:
+		d= dataset.open_input(input_file, "svm", dataset.read_svm, wants_cache)
+		if d is None:
+			d= dataset.read_svm(input_file)
+	else:
+		d= dataset.open_input(input_file, "csv:-1:0", dataset.read_csv, wants_cache)
+	if d is not None:
+		dataset.report_bad_lines(d)
+		return (as_sparse(d) if d.is_sparse else d.x), d.y
+	t= tempfile.TemporaryFile()
+	row_count= column_count= 0
+	while True:
+		lines= list(it.islice(input_file, chunk_rows))
+		if not lines:
+			break
+		a= np.array([line.split(',') for line in lines], dtype=float)
+		if row_count and a.shape[1] != column_count:
+			raise ValueError("lines %d to %d have %d columns instead of %d" % (row_count + 1, row_count + a.shape[0], a.shape[1], column_count))
+		t.write(a.tobytes())
+		row_count += a.shape[0]
+		column_count= a.shape[1]
+	if not row_count:
+		return np.zeros((0, 0)), np.zeros(0)
+	t.flush()
+	a= np.memmap(t, float, 'r', shape=(row_count, column_count))
+	return a[:, :-1], a[:, -1]
+
+def cost_and_gradient(theta, chunks, l):
+	# Accumulate the regularized cost and its gradient over the chunks in one
+	# pass, adding the bias term instead of a bias column.  Compute the margin
+	# of each chunk once for both and use the log-sum-exp form of the cost so
+	# large margins don't overflow.
+	from scipy.special import expit
+	cost= 0.0
+	grad= np.zeros_like(theta)
+	for x, y in chunks:
+		p= x @ theta[1:] + theta[0]
+		cost += np.sum(np.logaddexp(0, p) - y * p)
+		e= expit(p) - y
+		grad[0] += np.sum(e)
+		grad[1:] += x.T @ e
+	theta2= theta[1:]
+	cost += l / 2 * np.dot(theta2, theta2)
+	grad[1:] += l * theta2
+	return cost, grad
+
+def fit(chunks, column_count, l, solver="lbfgs", tolerance=1e-5, max_iterations=None, initial_theta=None):
+	# Minimize the fused cost and gradient, starting from zero unless given
+	# an initial theta.  L-BFGS keeps a few recent updates instead of the
+	# dense inverse Hessian of BFGS.  Conjugate gradients keep none.
+	if initial_theta is None:
+		initial_theta= np.zeros(column_count + 1)
+	if solver == "cg":
+		from minimize import minimize
+		def is_converged(theta, cost, grad):
+			return np.max(np.abs(grad)) < tolerance
+		theta, _, _= minimize(initial_theta, None, None, chunks, l, maxnumlinesearch=max_iterations or 1000, verbose=False, f_and_grad=cost_and_gradient, callback=is_converged)
+		return theta
+	options= {"gtol": tolerance}
+	if max_iterations:
+		options["maxiter"]= max_iterations
+	method= "L-BFGS-B" if solver == "lbfgs" else "BFGS"
+	result= sop.minimize(cost_and_gradient, initial_theta, (chunks, l), method, jac=True, options=options)
+	return result.x
+
+def adam(chunks, theta, l, epochs, batch_rows, learning_rate, seed, b1=0.9, b2=0.999, epsilon=1e-8):
+	# Minimize the mean cost with mini-batch Adam, shuffling the chunks and
+	# the rows within them each epoch.
+	from scipy.special import expit
+	rng= np.random.default_rng(seed)
+	m= np.zeros_like(theta)
+	v= np.zeros_like(theta)
+	t= 0
+	for _ in range(epochs):
+		for x, y in chunks.read(rng):
+			order= rng.permutation(len(y))
+			for i in range(0, len(y), batch_rows):
+				indices= order[i:i + batch_rows]
+				xb= x[indices]
+				e= expit(xb @ theta[1:] + theta[0]) - y[indices]
+				grad= np.empty_like(theta)
+				grad[0]= np.sum(e)
+				grad[1:]= xb.T @ e
+				grad /= len(indices)
+				grad[1:] += l / len(chunks) * theta[1:]
+				t += 1
+				m= b1 * m + (1 - b1) * grad
+				v= b2 * v + (1 - b2) * grad * grad
+				theta= theta - learning_rate * (m / (1 - b1 ** t)) / (np.sqrt(v / (1 - b2 ** t)) + epsilon)
+	return theta
+
+class StreamedModel(Model):
+	def __init__(self, chunks, column_count, l, m, s, solver="lbfgs", epochs=10, batch_rows=256, learning_rate=0.01, seed=None, tolerance=1e-5, max_iterations=None):
+		# Minimize a regularized cost function of the chunks of x onto y
+		# without holding them all in memory.
+		if solver == "adam":
+			theta= adam(chunks, np.zeros(column_count + 1), l, epochs, batch_rows, learning_rate, seed)
+		else:
+			theta= fit(chunks, column_count, l, solver, tolerance, max_iterations)
+		theta[0] -= np.sum(theta[1:] * m / s)
+		theta[1:] /= s
+		self.theta= theta
+
+def stream(input_file, output_file, regularization, wants_normalization, chunk_rows, solver, epochs, batch_rows, learning_rate, seed, is_libsvm=False, wants_cache=False, tolerance=1e-5, max_iterations=None):
+	import scipy.sparse as sps
+	x, y= map_input(input_file, chunk_rows, is_libsvm, wants_cache)
+	if len(y) == 0:
 		print("no data", file=sys.stderr)
 		return
+	chunks= Chunks(x, y, chunk_rows)
+	mu= np.zeros(x.shape[1])
+	sigma= np.ones(x.shape[1])
+	if wants_normalization:
+		mean, sigma= chunks.moments()
+		sigma[sigma == 0.0]= 1.0
+		if not sps.issparse(x):
+			mu= mean
+		chunks= Chunks(x, y, chunk_rows, mu, sigma)
+	model= StreamedModel(chunks, x.shape[1], regularization, mu, sigma, solver, epochs, batch_rows, learning_rate, seed, tolerance, max_iterations)
+	print(model, file=output_file)
 
-	# Create X and Y indices.  Assume the last column contains the output and
-	# the rest contain the inputs.
-	y_index= len(data[0]) - 1
-	x_indices= tuple(range(y_index))
+def read_normalized(input_file, wants_normalization, wants_cache=False):
+	# Read the entire file unless it is or has a binary dataset.
+	import dataset
+	d= dataset.open_input(input_file, "csv:-1:0", dataset.read_csv, wants_cache)
+	if d is not None:
+		dataset.report_bad_lines(d)
+	if d is None:
+		data= tuple(tuple(map(float, line.split(','))) for line in input_file)
+		if len(data) == 0:
+			return None
+
+		# Create X and Y indices.  Assume the last column contains the output
+		# and the rest contain the inputs.
+		y_index= len(data[0]) - 1
+		x_indices= tuple(range(y_index))
+		data= np.array(data)
+		x= np.compress(as_bools(x_indices), data, 1)
+		y= np.compress(as_bools(y_index), data, 1).squeeze()
+	elif len(d) == 0:
+		return None
+	else:
+		x= np.array(d.dense())
+		y= np.array(d.y)
 
-	# Create and print the model parameters, normalizing the data if requested.
-	data= np.array(data)
-	x= np.compress(as_bools(x_indices), data, 1)
+	# Normalize the data if requested.
 	mu= list(it.repeat(0.0, x.shape[1]))
 	sigma= list(it.repeat(1.0, x.shape[1]))
 	if wants_normalization:
@@ -71,17 +282,176 @@ def doit(input_file, output_file, regularization, wants_normalization):
 			if sigma[i] == 0.0:
 				sigma[i]= 1.0
 			x[:,i]= (x[:,i] - mu[i]) / sigma[i]
-	y= np.compress(as_bools(y_index), data, 1).squeeze()
-	model= MinimizedModel(x, y, regularization, mu, sigma)
+	return x, y, mu, sigma
+
+def doit(input_file, output_file, regularization, wants_normalization, wants_cache=False, solver="lbfgs", tolerance=1e-5, max_iterations=None):
+	data= read_normalized(input_file, wants_normalization, wants_cache)
+	if data is None:
+		print("no data", file=sys.stderr)
+		return
+
+	# Create and print the model parameters.
+	x, y, mu, sigma= data
+	model= MinimizedModel(x, y, regularization, mu, sigma, solver, tolerance, max_iterations)
 	print(model, file=output_file)
 
+def parse_lambdas(s):
+	# Parse a regularization value, a comma-delimited list of them, or a
+	# range "first:last:count" of positive values spaced evenly on a log
+	# scale.
+	if ':' in s:
+		first, last, count= s.split(':')
+		return np.geomspace(float(first), float(last), int(count)).tolist()
+	return [float(t) for t in s.split(',')]
+
+# The arrays a path task reads, either those of this process or those
+# attached from shared memory in a pool process.
+shared= {}
+
+def attach(layout):
+	from multiprocessing import shared_memory
+	for key, (name, dtype, shape) in layout.items():
+		m= shared_memory.SharedMemory(name)
+		shared[key]= m, np.ndarray(shape, dtype, m.buf)
+
+def fit_path(task):
+	# Fit the lambdas in order, warm-starting each fit from the previous one.
+	# For a fold, fit the other folds and return the loss on the fold;
+	# otherwise, return the fitted thetas.
+	lambdas, fold, solver, tolerance, max_iterations= task
+	x, y= shared["x"][1], shared["y"][1]
+	if fold is not None:
+		is_held_out= shared["folds"][1] == fold
+		x_test, y_test= x[is_held_out], y[is_held_out]
+		x, y= x[~is_held_out], y[~is_held_out]
+	theta= None
+	results= []
+	for l in lambdas:
+		theta= fit(((x, y),), x.shape[1], l, solver, tolerance, max_iterations, theta)
+		if fold is None:
+			results.append(theta)
+		else:
+			p= x_test @ theta[1:] + theta[0]
+			results.append(np.mean(np.logaddexp(0, p) - y_test * p))
+	return results
+
+def path(input_file, output_file, lambdas, wants_normalization, wants_cache=False, solver="lbfgs", tolerance=1e-5, max_iterations=None, fold_count=0, jobs=1, seed=None):
+	# Read and normalize the data once and fit each lambda, splitting the
+	# lambdas into one warm-started sequence per job.
+	data= read_normalized(input_file, wants_normalization, wants_cache)
+	if data is None:
+		print("no data", file=sys.stderr)
+		return
+	x, y, mu, sigma= data
+	arrays= {"x": x, "y": y}
+	if fold_count:
+		arrays["folds"]= np.random.default_rng(seed).permutation(len(y)) % fold_count
+	segments= [a.tolist() for a in np.array_split(lambdas, min(jobs, len(lambdas)))]
+	tasks= [(segment, fold, solver, tolerance, max_iterations) for fold in [None] + list(range(fold_count)) for segment in segments]
+	if jobs > 1:
+		import multiprocessing
+		from multiprocessing import shared_memory
+		memories= []
+		try:
+			layout= {}
+			for key, a in arrays.items():
+				m= shared_memory.SharedMemory(create=True, size=max(a.nbytes, 1))
+				memories.append(m)
+				np.ndarray(a.shape, a.dtype, m.buf)[...]= a
+				layout[key]= m.name, a.dtype.str, a.shape
+			del x, y, arrays
+			with multiprocessing.Pool(jobs, attach, (layout,)) as pool:
+				results= pool.map(fit_path, tasks, 1)
+		finally:
+			for m in memories:
+				m.close()
+				m.unlink()
+	else:
+		shared.update((key, (None, a)) for key, a in arrays.items())
+		results= list(map(fit_path, tasks))
+
+	# Print one model per lambda and, for k-fold validation, the mean loss on
+	# the held-out folds for each lambda.
+	n= len(segments)
+	for theta in sum(results[:n], []):
+		theta[0] -= np.sum(theta[1:] * mu / sigma)
+		theta[1:] /= sigma
+		print(" ".join(map(str, theta.flat)), file=output_file)
+	if fold_count:
+		losses= [sum(results[i:i + n], []) for i in range(n, len(results), n)]
+		for l, loss in zip(lambdas, np.mean(losses, 0)):
+			print("%g %g" % (l, loss), file=sys.stderr)
+
+def benchmark(row_count=5000, column_counts=(10, 100, 400, 1000), regularization=1.0):
+	# Compare the original BFGS model with the fused BFGS, L-BFGS, and
+	# conjugate gradient ones across feature widths.
+	from benchmark import measure, report
+	rng= np.random.default_rng(1)
+	for column_count in column_counts:
+		x= rng.normal(size=(row_count, column_count))
+		w= rng.normal(size=column_count)
+		y= (np.dot(x, w) + rng.logistic(size=row_count) > 0).astype(float)
+		m= np.zeros(column_count)
+		s= np.ones(column_count)
+		def run(name):
+			if name == "original":
+				model= OriginalModel(x, y, regularization, m, s)
+			else:
+				model= MinimizedModel(x, y, regularization, m, s, name)
+			cost, _= cost_and_gradient(model.theta, ((x, y),), regularization)
+			print("%s %d cost=%.6f" % (name, column_count, cost), file=sys.stderr)
+		for name in ["original", "bfgs", "lbfgs", "cg"]:
+			elapsed, peak_rss= measure(run, name)
+			report("%s (%d)" % (name, column_count), elapsed, peak_rss, rows=row_count, columns=column_count)
+
 if __name__ == "__main__":
+	if "--benchmark" in sys.argv:
+		benchmark()
+		exit(0)
 	parser = argparse.ArgumentParser(description="""Creates logistic regression
 		model parameters.""", epilog="""The output variable must be in the last
-		column of the input.""")
+		column of the input.  The input may be a binary dataset.  The lbfgs,
+		bfgs, and cg solvers evaluate the cost and gradient together; lbfgs and
+		cg (conjugate gradients) use memory proportional to the number of
+		features rather than its square.
+		Streaming evaluates them a chunk at a time; the adam solver instead
+		takes mini-batch steps and also streams.  Given several regularization
+		values, as a comma-delimited list or a range first:last:count of values
+		spaced evenly on a log scale, it reads the input once and prints one
+		model per value, warm-starting each fit from the one before it; jobs
+		split the values into sequences fitted in parallel on shared data.
+		Folds report the mean validation loss for each value on standard
+		error.  LIBSVM input, which
+		also streams, is normalized by scaling without centering so that it
+		stays sparse.""")
 	parser.add_argument("-n", "--normalize", action="store_true",
 		help="normalize the inputs and output model")
-	parser.add_argument("regularization", type=float)
+	parser.add_argument("-C", "--cache", action="store_true",
+		help="cache the parsed input file as a binary dataset")
+	parser.add_argument("-l", "--libsvm", action="store_true",
+		help="read LIBSVM input into a sparse matrix")
+	parser.add_argument("-k", "--chunk-size", metavar="ROWS", type=int, default=0,
+		help="stream chunks of this many rows from a memory-mapped copy of the input")
+	parser.add_argument("-o", "--solver", choices=["lbfgs", "bfgs", "cg", "adam"], default="lbfgs",
+		help="the minimizer to use (default %(default)s)")
+	parser.add_argument("-t", "--tolerance", type=float, default=1e-5,
+		help="the gradient norm at which to stop for lbfgs, bfgs, and cg (default %(default)s)")
+	parser.add_argument("-i", "--max-iterations", metavar="N", type=int,
+		help="the maximum number of iterations (line searches for cg)")
+	parser.add_argument("-e", "--epochs", type=int, default=10,
+		help="the number of passes over the input for adam (default %(default)s)")
+	parser.add_argument("-b", "--batch-size", metavar="ROWS", type=int, default=256,
+		help="the number of rows per mini-batch for adam (default %(default)s)")
+	parser.add_argument("-a", "--learning-rate", type=float, default=0.01,
+		help="the learning rate for adam (default %(default)s)")
+	parser.add_argument("-s", "--seed", type=int,
+		help="the random seed for adam and folds")
+	parser.add_argument("-f", "--folds", metavar="K", type=int, default=0,
+		help="report the K-fold validation loss for each regularization value")
+	parser.add_argument("-j", "--jobs", metavar="N", type=int, default=1,
+		help="the number of processes fitting regularization values (default %(default)s)")
+	parser.add_argument("regularization", type=parse_lambdas,
+		help="the regularization value or values")
 	parser.add_argument("input_file", nargs="?",
 		type=argparse.FileType('r'), default=sys.stdin,
 		help="the input data file")
@@ -89,4 +459,11 @@ if __name__ == "__main__":
 		type=argparse.FileType('w'), default=sys.stdout,
 		help="the output data file")
 	args = parser.parse_args()
-	doit(args.input_file, args.output_file, args.regularization, args.normalize)
+	if len(args.regularization) > 1 or args.folds:
+		if args.chunk_size or args.solver == "adam" or args.libsvm:
+			parser.error("multiple regularization values and folds require in-memory training")
+		path(args.input_file, args.output_file, args.regularization, args.normalize, args.cache, args.solver, args.tolerance, args.max_iterations, args.folds, args.jobs, args.seed)
+	elif args.chunk_size or args.solver == "adam" or args.libsvm:
+		stream(args.input_file, args.output_file, args.regularization[0], args.normalize, args.chunk_size or 65536, args.solver, args.epochs, args.batch_size, args.learning_rate, args.seed, args.libsvm, args.cache, args.tolerance, args.max_iterations)
+	else:
+		doit(args.input_file, args.output_file, args.regularization[0], args.normalize, args.cache, args.solver, args.tolerance, args.max_iterations)
@@ -1,46 +1,72 @@
 #!/usr/bin/env python3
 
 import argparse
-import itertools as it
 import sys
+import tempfile
 import csr
 
-def normalize(l, lower, width):
-	minimum= min(l)
-	maximum= max(l)
-	d= (maximum - minimum) / width
-	l[:]= [(v - minimum) / d + lower for v in l]
+SPOOL_SIZE= 64 << 20
+
+def make_passes(input_file):
+	# Return the lines for the first pass and a function that returns them
+	# again for the second pass, spooling them if the input can't be reread.
+	if isinstance(input_file, (list, tuple)):
+		return input_file, lambda: input_file
+	seekable= getattr(input_file, "seekable", None)
+	if seekable and seekable():
+		def reread():
+			input_file.seek(0)
+			return input_file
+		return input_file, reread
+	t= tempfile.SpooledTemporaryFile(SPOOL_SIZE, mode="w+")
+	def tee():
+		for line in input_file:
+			t.write(line if line.endswith("\n") else line + "\n")
+			yield line
+	def reread():
+		t.seek(0)
+		return t
+	return tee(), reread
 
 def doit(input_file, output_file, columns, delimiter, wants_negative_one, has_header):
-	# Read the entire input, accounting for the header, if any.
+	# Find the minimum and maximum of the desired columns in a first pass,
+	# accounting for the header, if any.
+	lines, reread= make_passes(input_file)
+	g= iter(lines)
 	if has_header:
-		header= next(input_file)
-	data= tuple(line.rstrip().split(delimiter) for line in input_file)
-	if not data:
+		header= next(g)
+	indices= None
+	for line in g:
+		parts= line.rstrip().split(delimiter)
+		if indices is None:
+			# Determine desired column indices.
+			indices= csr.parse(columns, True) if columns else tuple(range(len(parts)))
+			minima= [float(parts[i]) for i in indices]
+			maxima= minima[:]
+		for j, i in enumerate(indices):
+			v= float(parts[i])
+			if v < minima[j]:
+				minima[j]= v
+			elif v > maxima[j]:
+				maxima[j]= v
+	if indices is None:
 		return
 
 	# Set the lower bound and width, if necessary.
 	lower= -1.0 if wants_negative_one else 0.0
 	width= 1.0 - lower
+	d= [(maximum - minimum) / width for minimum, maximum in zip(minima, maxima)]
 
-	# Determine desired column indices.
-	indices= csr.parse(columns, true) if columns else tuple(range(len(data[0])))
-
-	# Transpose the data into rows.
-	data= list(zip(*data))
-
-	# Normalize the desired columns, now in rows.
-	for i in indices:
-		data[i]= list(map(float, data[i]))
-		normalize(data[i], lower, width)
-
-	# Transpose the data back into columns.
-	data= list(zip(*data))
-
+	# Normalize the desired columns in a second pass.
+	g= iter(reread())
 	if has_header:
+		next(g)
 		print(header, end="", file=output_file)
-	for row in data:
-		print(*row, sep=delimiter, file=output_file)
+	for line in g:
+		parts= line.rstrip().split(delimiter)
+		for j, i in enumerate(indices):
+			parts[i]= (float(parts[i]) - minima[j]) / d[j] + lower
+		print(*parts, sep=delimiter, file=output_file)
 
 if __name__ == "__main__":
 	if "--test" in sys.argv:
@@ -2,68 +2,59 @@
 
 import argparse
 import itertools as it
-import pygal
 import sys
 
 def as_parts(s):
   return s.strip().split(",")
 
-def try_float(s):
-  return float(s) if s else None
-
-class Row:
-  legend_column= None
-  count= 0
-
-  def __init__(self, parts):
-    self.data= []
-    Row.count += 1
-    self.legend= str(Row.count)
-    for i, s in enumerate(parts):
-      if i == Row.legend_column:
-        self.legend= s
-      elif i in Row.column_indices:
-        self.data.append(try_float(s))
-
-def doit(input_file, output_file, wants_stacked, has_header, title, legend_column, columns, configuration):
-  # Read the entire input.
-  input_file= tuple(map(as_parts, input_file))
-  if not len(input_file):
-    print("no data", file=sys.stderr)
-    return
+def doit(input_file, output_file, wants_stacked, has_header, title, legend_column, columns, configuration, how=None, wants_svg=False):
+  from columns import aggregate, read
+  key_index= legend_column - 1 if legend_column else None
 
   # If there is a header, read it for the title and X labels.
   x_labels= None
-  first_row_index= 0
   if has_header:
-    parts= input_file[0]
-    first_row_index= 1
-    if legend_column:
-      Row.legend_column= int(legend_column) - 1
-      if not title:
-        title= parts[Row.legend_column]
-    x_labels= tuple(s for i, s in enumerate(parts) if i != Row.legend_column)
+    parts= as_parts(next(input_file, ""))
+    if key_index is not None and not title and key_index < len(parts):
+      title= parts[key_index]
 
   # Determine desired column indices.
   if columns:
     from csr import parse as parse_ranges
-    Row.column_indices= parse_ranges(columns, as_index= True)
+    indices= parse_ranges(columns, as_index= True)
+  elif has_header:
+    indices= tuple(i for i in range(len(parts)) if i != key_index)
   else:
-    Row.column_indices= tuple(range(len(input_file[0])))
+    indices= None
+  if has_header:
+    x_labels= tuple(parts[i] if i < len(parts) else "" for i in indices)
 
-  # Extract the desired columns from the input.
-  data= tuple(map(Row, input_file[first_row_index:]))
-  if len(data) == 0:
+  # Read only the desired columns from the input, combining the rows with
+  # the same legend if requested.
+  if how:
+    legends, data= aggregate(input_file, indices, ",", key_index, how)
+  else:
+    legends, data= read(input_file, indices, ",", key_index)
+  row_count= len(data[0]) if data else len(legends or ())
+  if row_count == 0:
     print("no data", file=sys.stderr)
     return
+  if legends is None:
+    legends= [str(i + 1) for i in range(row_count)]
 
   # Create the chart.
+  if wants_svg:
+    from svgchart import bar_chart
+    series= [[column[i] for column in data] for i in range(row_count)]
+    bar_chart(output_file, legends, series, title, x_labels, wants_stacked, row_count != 1)
+    return
+  import pygal
   chart_type= pygal.StackedBar if wants_stacked else pygal.Bar
-  chart= chart_type(show_legend= len(data) != 1)
+  chart= chart_type(show_legend= row_count != 1)
   if title:
     chart.title= title
-  for row in data:
-    chart.add(row.legend, row.data)
+  for i, legend in enumerate(legends):
+    chart.add(legend, [None if column[i] != column[i] else column[i] for column in data])
   if x_labels:
     chart.x_labels= x_labels
   if configuration:
@@ -77,7 +68,11 @@ def doit(input_file, output_file, wants_stacked, has_header, title, legend_colum
 if __name__ == "__main__":
   parser = argparse.ArgumentParser(description="Plots data as a bar chart.",
     epilog="""If skipping the first line as a header, it is used to specify the
-    title (in the legend column if not otherwise provided) and X labels.""")
+    title (in the legend column if not otherwise provided) and X labels.  Only
+    the plotted columns are kept while reading.  The aggregate option plots
+    one bar per legend with the sum or mean of the lines having it.  The SVG
+    option writes the chart directly instead of with pygal and ignores the
+    configuration.""")
   parser.add_argument("-k", "--stacked", action="store_true",
     help="create a stacked bar chart")
   parser.add_argument("-s", "--skip-header", action="store_true",
@@ -88,8 +83,12 @@ if __name__ == "__main__":
     help="the title of the chart")
   parser.add_argument("-l", "--legend", type=int, metavar="N",
     help="the column number of the legend")
+  parser.add_argument("-a", "--aggregate", choices=["sum", "mean"],
+    help="combine the lines with the same legend")
   parser.add_argument("-n", "--configuration",
     help="additional configuration for the chart")
+  parser.add_argument("-g", "--svg", action="store_true",
+    help="write the SVG directly without pygal")
   parser.add_argument("input_file", nargs="?",
     type=argparse.FileType('r'), default=sys.stdin,
     help="the input CSV file (default standard input)")
@@ -97,4 +96,6 @@ if __name__ == "__main__":
     type=argparse.FileType('w'), default=sys.stdout,
     help="the output SVG file (default standard output)")
   args = parser.parse_args()
-  doit(args.input_file, args.output_file, args.stacked, args.skip_header, args.title, args.legend, args.columns, args.configuration)
+  if args.aggregate and not args.legend:
+    parser.error("the aggregate option requires a legend column")
+  doit(args.input_file, args.output_file, args.stacked, args.skip_header, args.title, args.legend, args.columns, args.configuration, args.aggregate, args.svg)
@@ -3,55 +3,159 @@
 import argparse
 import datetime
 import itertools as it
-import pygal
 import sys
 
-def doit(input_file, output_file, columns, delimiter, has_header, title, x_column):
-	# Read the entire input, accounting for the header, if any.
-	g= (line.rstrip().split(delimiter) for line in input_file)
-	if has_header:
-		header= next(g)
-	data= tuple(g)
-	if not data:
-		return
+class Buckets:
+	# Keeps the minimum and maximum of each series and the first and last X
+	# labels of at most capacity buckets of consecutive rows, ignoring missing
+	# (NaN) values.  When the buckets fill up, it merges adjacent pairs,
+	# doubling the rows per bucket, so memory is O(capacity) per series for
+	# any number of rows.
+	def __init__(self, series_count, capacity):
+		self.capacity= max(2, capacity - capacity % 2)
+		self.size= 1
+		self.row_count= 0
+		self.labels= []
+		self.extremes= [[] for _ in range(series_count)]
 
-	# Transpose the data into rows.
-	data= list(zip(*data))
-	if not has_header:
-		header= tuple("F%d" % i for i in range(len(data)))
+	def add(self, values, label=None):
+		if self.row_count % self.size == 0:
+			if len(self.labels) == self.capacity:
+				self.merge()
+			self.labels.append([label, label])
+			for e, v in zip(self.extremes, values):
+				e.append([self.row_count, v, self.row_count, v])
+		else:
+			self.labels[-1][1]= label
+			for e, v in zip(self.extremes, values):
+				b= e[-1]
+				if v < b[1] or b[1] != b[1]:
+					b[0], b[1]= self.row_count, v
+				if v > b[3] or b[3] != b[3]:
+					b[2], b[3]= self.row_count, v
+		self.row_count += 1
+
+	def merge(self):
+		def pair(g):
+			l= list(g)
+			return zip(l[0::2], l[1::2]), l[-1:] if len(l) % 2 else []
+		pairs, rest= pair(self.labels)
+		self.labels= [[a[0], b[1]] for a, b in pairs] + rest
+		for i, e in enumerate(self.extremes):
+			pairs, rest= pair(e)
+			self.extremes[i]= [(b[:2] if b[1] < a[1] or a[1] != a[1] else a[:2]) + (b[2:] if b[3] > a[3] or a[3] != a[3] else a[2:]) for a, b in pairs] + rest
+		self.size *= 2
+
+	def min_max(self, max_points):
+		# Return the X labels and the series with the minimum and maximum of
+		# each bucket in row order, merging until they fit in max_points.
+		if self.size == 1 and len(self.labels) <= max_points:
+			return [l[0] for l in self.labels], [[b[1] for b in e] for e in self.extremes]
+		while 2 * len(self.labels) > max_points and len(self.labels) > 1:
+			self.merge()
+		labels= [l for pair in self.labels for l in pair]
+		series= [[v for b in e for v in ((b[1], b[3]) if b[0] <= b[2] else (b[3], b[1]))] for e in self.extremes]
+		return labels, series
+
+	def lttb(self, max_points):
+		# Return the X labels and the series with points selected from the
+		# minima and maxima of the buckets using largest-triangle-three-buckets.
+		# Each series has one point per bucket of candidates, so they share
+		# X labels.
+		import numpy as np
+		if self.size == 1 and len(self.labels) <= max_points:
+			return [l[0] for l in self.labels], [[b[1] for b in e] for e in self.extremes]
+		labels= [l for pair in self.labels for l in pair]
+		edges= lttb_edges(len(labels), max_points)
+		series= []
+		for e in self.extremes:
+			a= np.array(e, dtype=float)
+			x= a[:, [0, 2]].ravel()
+			y= a[:, [1, 3]].ravel()
+			series.append(y[lttb(x, y, edges)].tolist())
+		return [labels[i] for i in edges[:-1]], series
+
+def lttb_edges(n, threshold):
+	# Return the start of each bucket: one each for the first and last points
+	# and threshold - 2 for those between them, followed by n.
+	import numpy as np
+	threshold= max(3, min(threshold, n))
+	return np.concatenate(([0], np.linspace(1, n - 1, threshold - 1).astype(int), [n]))
 
-	# Determine the X column (now row) labels, if any.
-	if x_column:
-		x_labels= data[int(x_column) - 1]
+def lttb(x, y, edges):
+	# Select a point from each bucket, keeping the first and last points, that
+	# forms the largest triangle with the point selected from the previous
+	# bucket and the average of the next bucket.
+	import numpy as np
+	selected= [0]
+	for k in range(1, len(edges) - 2):
+		lo, hi, next_hi= edges[k], edges[k + 1], edges[k + 2]
+		a= selected[-1]
+		x_mean, y_mean= x[hi:next_hi].mean(), y[hi:next_hi].mean()
+		areas= np.abs((x[a] - x_mean) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (y_mean - y[a]))
+		selected.append(lo + int(np.argmax(areas)))
+	selected.append(len(x) - 1)
+	return selected
 
-	# Determine desired column (now row) indices.
+def doit(input_file, output_file, columns, delimiter, has_header, title, x_column, max_points=0, method="min-max", wants_svg=False):
+	from columns import blocks, read
+	from csr import parse as parse_ranges
+
+	# Read the header, if any, and determine the desired column indices.
+	lines= iter(input_file)
+	header= next(lines, "").rstrip().split(delimiter) if has_header else None
+	first= next(lines, None)
+	if first is None:
+		return
+	lines= it.chain([first], lines)
+	x_index= int(x_column) - 1 if x_column else None
 	if columns:
-		def as_index_range(s):
-			parts= s.split('-')
-			return range(int(parts[0]) - 1, int(parts[-1]))
-		indices= tuple(it.chain(*map(as_index_range, columns.split(','))))
+		indices= parse_ranges(columns, True)
 	else:
-		indices= tuple(range(len(data[0])))
+		indices= tuple(i for i in range(len(first.split(delimiter))) if i != x_index)
+	if not has_header:
+		header= tuple("F%d" % i for i in range(max(indices) + 1))
 
-	# Convert the desired columns (now rows) of data into floats.
-	def convert(row):
-		return tuple(map(float, row))
-	g= (data[i] for i in indices)
-	data= tuple(map(convert, g))
+	# Read only the desired columns, reducing them to at most max points if
+	# requested.
+	if max_points:
+		buckets= Buckets(len(indices), max_points)
+		for labels, data in blocks(lines, indices, delimiter, x_index):
+			for label, values in zip(labels or it.repeat(None), zip(*data)):
+				buckets.add(values, label)
+		x_labels, data= buckets.lttb(max_points) if method == "lttb" else buckets.min_max(max_points)
+		if x_index is None:
+			x_labels= None
+	else:
+		x_labels, data= read(lines, indices, delimiter, x_index)
 	header= tuple(header[i] for i in indices)
+	if wants_svg:
+		from svgchart import line_chart
+		line_chart(output_file, header, data, title, x_labels)
+	else:
+		chart(output_file, title, header, x_labels, data)
 
+def chart(output_file, title, header, x_labels, data):
 	# Create the line chart.
+	import pygal
 	c= pygal.Line(show_dots=False)
 	if title:
 		c.title= title
-	if x_column:
+	if x_labels:
 		c.x_labels= x_labels
 	for i, row in enumerate(data):
-		c.add(header[i], row)
+		c.add(header[i], [None if v != v else v for v in row])
 	print(c.render().decode(), file=output_file)
 
 if __name__ == "__main__":
-	parser= argparse.ArgumentParser(description="Creates a line chart of data.")
+	parser= argparse.ArgumentParser(description="Creates a line chart of data.",
+		epilog="""Only the plotted columns are kept while reading.  Missing values
+		are not plotted.  The max points option reads the input once, keeping
+		the minimum and maximum of each series for buckets of consecutive lines,
+		so peaks remain visible.  The min-max method plots both for each bucket;
+		the lttb method selects one of them per bucket using
+		largest-triangle-three-buckets.  The SVG option writes the chart directly
+		instead of with pygal, for charts with many points.""")
 	parser.add_argument("-d", "--delimiter", metavar="C",
 		help="column delimiter character (default whitespace)")
 	parser.add_argument("-l", "--legend", action="store_true",
@@ -60,6 +164,12 @@ if __name__ == "__main__":
 		help="title of the chart")
 	parser.add_argument("-x", "--x-labels", metavar="N",
 		help="column number of data containing labels for X axis")
+	parser.add_argument("-m", "--max-points", metavar="N", type=int, default=0,
+		help="plot at most this many points per series")
+	parser.add_argument("-a", "--method", choices=["min-max", "lttb"], default="min-max",
+		help="how to reduce the points (default %(default)s)")
+	parser.add_argument("-g", "--svg", action="store_true",
+		help="write the SVG directly without pygal")
 	parser.add_argument("columns",
 		help="comma-delimited ranges of column numbers to plot")
 	parser.add_argument("input_file", nargs='?',
@@ -68,4 +178,4 @@ if __name__ == "__main__":
 		type=argparse.FileType('w'), default=sys.stdout,
 		help="output SVG file")
 	args= parser.parse_args()
-	doit(args.input_file, args.output_file, args.columns, args.delimiter, args.legend, args.title, args.x_labels)
+	doit(args.input_file, args.output_file, args.columns, args.delimiter, args.legend, args.title, args.x_labels, args.max_points, args.method, args.svg)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+import argparse
+import io
+import sys
+from lazy import LazyModule
+
+np= LazyModule("numpy")
+
+CHUNK_SIZE= 4 << 20
+
+# The scorer of a worker process.
+scorer= None
+
+def read_model(model_file, line_number):
+	# Read theta from a model line as printed by lor.py, counting only
+	# non-blank lines.
+	lines= [line for line in model_file if line.strip()]
+	if not 0 < line_number <= len(lines):
+		raise ValueError("no model on line %d" % line_number)
+	return np.array(lines[line_number - 1].split(), dtype=float)
+
+class Scorer:
+	# Computes sigmoid(x . w + b) for each line of a chunk of CSV or LIBSVM
+	# input into a buffer reused across chunks and formats the probabilities
+	# or labels.
+	def __init__(self, theta, is_libsvm=False, wants_labels=False, threshold=0.5, precision=7):
+		self.theta= theta
+		self.is_libsvm= is_libsvm
+		self.wants_labels= wants_labels
+		self.threshold= threshold
+		self.fmt= "%%.%dg\n" % precision
+		self.buffer= np.empty(0)
+
+	def score_csv(self, chunk, out):
+		# Ignore a last column that holds the target, as in training data.
+		x= np.loadtxt(io.BytesIO(chunk), delimiter=',', ndmin=2)
+		w= self.theta[1:]
+		if x.shape[1] == len(w) + 1:
+			x= x[:, :-1]
+		elif x.shape[1] != len(w):
+			raise ValueError("expected %d features but got %d" % (len(w), x.shape[1]))
+		out= out[:len(x)]
+		np.dot(x, w, out=out)
+		return out
+
+	def score_svm(self, chunk, out):
+		# Parse all numbers at once, then separate the targets from the index
+		# and value pairs using the number of pairs on each line.  Ignore
+		# features the model doesn't have.
+		counts= np.array([line.count(b':') for line in chunk.split(b'\n') if line.strip()], dtype=np.int64)
+		numbers= np.fromstring(chunk.replace(b':', b' '), sep=' ')
+		is_target= np.zeros(len(numbers), dtype=bool)
+		is_target[np.cumsum(2 * counts + 1) - (2 * counts + 1)]= True
+		pairs= numbers[~is_target].reshape(-1, 2)
+		indices= pairs[:, 0].astype(np.int64) - 1
+		w= self.theta[1:]
+		is_known= (indices >= 0) & (indices < len(w))
+		rows= np.repeat(np.arange(len(counts)), counts)[is_known]
+		out= out[:len(counts)]
+		out[:]= np.bincount(rows, w[indices[is_known]] * pairs[is_known, 1], len(counts))
+		return out
+
+	def __call__(self, chunk):
+		# Score the non-blank lines and write an empty line for each blank one
+		# so the output lines up with the input.
+		from scipy.special import expit
+		lines= chunk.split(b'\n')
+		if lines[-1] == b"":
+			lines.pop()
+		is_blank= [not line.strip() for line in lines]
+		has_blank_lines= any(is_blank)
+		if has_blank_lines:
+			chunk= b"".join(line + b"\n" for line, blank in zip(lines, is_blank) if not blank)
+		row_count= len(lines) - sum(is_blank)
+		if len(self.buffer) < row_count:
+			self.buffer= np.empty(row_count)
+		out= (self.score_svm if self.is_libsvm else self.score_csv)(chunk, self.buffer) if row_count else self.buffer[:0]
+		out += self.theta[0]
+		if self.wants_labels:
+			# The probability exceeds the threshold where the margin exceeds its
+			# logit.
+			threshold= np.log(self.threshold / (1 - self.threshold))
+			text= np.array([b"0\n", b"1\n"], dtype="S2")[(out > threshold).astype(np.int8)].tobytes()
+		else:
+			expit(out, out=out)
+			text= ((self.fmt * len(out)) % tuple(out.tolist())).encode()
+		if has_blank_lines:
+			rows= iter(text.splitlines(True))
+			text= b"".join(b"\n" if blank else next(rows) for blank in is_blank)
+		return text
+
+def start(s):
+	global scorer
+	scorer= s
+
+def score(chunk):
+	return scorer(chunk)
+
+def doit(model_file, input_file, output_file, line_number, is_libsvm, wants_labels, threshold, precision, chunk_size, jobs):
+	from quoted_line import read_chunks
+	s= Scorer(read_model(model_file, line_number), is_libsvm, wants_labels, threshold, precision)
+	input_file= getattr(input_file, "buffer", input_file)
+	output_file= getattr(output_file, "buffer", output_file)
+	chunks= read_chunks(input_file, chunk_size)
+	if jobs > 1:
+		# Score chunks in a pool of processes with a bounded number of
+		# outstanding chunks, writing them in order.
+		import collections
+		import multiprocessing
+		with multiprocessing.Pool(jobs, start, (s,)) as pool:
+			pending= collections.deque()
+			for chunk in chunks:
+				pending.append(pool.apply_async(score, (chunk,)))
+				if len(pending) >= 2 * jobs:
+					output_file.write(pending.popleft().get())
+			while pending:
+				output_file.write(pending.popleft().get())
+	else:
+		for chunk in chunks:
+			output_file.write(s(chunk))
+	output_file.flush()
+
+def benchmark(row_count=1000000, column_count=10):
+	# Measure the scoring rate for CSV and LIBSVM input.
+	import os
+	import tempfile
+	from benchmark import measure, report
+	rng= np.random.default_rng(1)
+	theta= rng.normal(size=column_count + 1)
+	x= np.round(rng.normal(size=(row_count, column_count)), 4)
+	x[rng.random(x.shape) < 0.5]= 0
+	paths= []
+	for is_libsvm in [False, True]:
+		fd, path= tempfile.mkstemp()
+		with os.fdopen(fd, 'w') as fout:
+			for row in x.tolist():
+				if is_libsvm:
+					print(1, *("%d:%g" % (i + 1, v) for i, v in enumerate(row) if v), file=fout)
+				else:
+					print(*row, sep=',', file=fout)
+		paths.append(path)
+	def run(path, is_libsvm, wants_labels, jobs):
+		with open(path, "rb") as fin, open(os.devnull, "wb") as fout:
+			doit(io.StringIO(" ".join(map(str, theta))), fin, fout, 1, is_libsvm, wants_labels, 0.5, 7, CHUNK_SIZE, jobs)
+	for name, path, is_libsvm, wants_labels, jobs in [
+			("csv", paths[0], False, False, 1),
+			("csv labels", paths[0], False, True, 1),
+			("csv 2 jobs", paths[0], False, False, 2),
+			("libsvm", paths[1], True, False, 1),
+			("libsvm labels", paths[1], True, True, 1)]:
+		elapsed, peak_rss= measure(run, path, is_libsvm, wants_labels, jobs)
+		report(name, elapsed, peak_rss, rows_per_second=int(row_count / elapsed), input_bytes=os.path.getsize(path))
+	for path in paths:
+		os.remove(path)
+
+if __name__ == "__main__":
+	if "--benchmark" in sys.argv:
+		benchmark()
+		exit(0)
+	parser = argparse.ArgumentParser(description="""Scores data with a
+		logistic regression model created by lor.py.""", epilog="""CSV input may
+		include the target in its last column, as in training data; predict.py
+		ignores it.  LIBSVM input ignores features the model doesn't have.  The
+		output has the probability or, with the labels option, the predicted
+		label (0 or 1) of each line, or an empty line for a blank one.""")
+	parser.add_argument("-l", "--libsvm", action="store_true",
+		help="read LIBSVM input instead of CSV")
+	parser.add_argument("-m", "--model-line", metavar="N", type=int, default=1,
+		help="the line of the model file containing the model (default %(default)s)")
+	parser.add_argument("-L", "--labels", action="store_true",
+		help="write labels instead of probabilities")
+	parser.add_argument("-t", "--threshold", type=float, default=0.5,
+		help="the probability above which the label is 1 (default %(default)s)")
+	parser.add_argument("-p", "--precision", default=7, type=int,
+		help="number of significant figures (default %(default)s)")
+	parser.add_argument("-c", "--chunk-size", metavar="BYTES", type=int, default=CHUNK_SIZE,
+		help="score chunks of about this many bytes at a time (default %(default)s)")
+	parser.add_argument("-j", "--jobs", metavar="N", type=int, default=1,
+		help="the number of processes scoring chunks (default %(default)s)")
+	parser.add_argument("model_file", type=argparse.FileType('r'),
+		help="the model file written by lor.py")
+	parser.add_argument("input_file", nargs="?",
+		type=argparse.FileType('r'), default=sys.stdin,
+		help="the input data file")
+	parser.add_argument("output_file", nargs="?",
+		type=argparse.FileType('w'), default=sys.stdout,
+		help="the output data file")
+	args = parser.parse_args()
+	if not 0 < args.threshold < 1:
+		parser.error("the threshold must be between 0 and 1")
+	doit(args.model_file, args.input_file, args.output_file, args.model_line, args.libsvm, args.labels, args.threshold, args.precision, args.chunk_size, args.jobs)
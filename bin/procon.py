@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+from procpool import run
+
+if __name__ == "__main__":
+  parser= argparse.ArgumentParser(description="Runs command lines fed from input concurrently up to limit.",
+    epilog="""If the limit is less than one, it uses the number of processors.
+    It starts the next command as soon as one finishes.  Commands read
+    standard input from /dev/null.  The ordered option
+    collects the standard output of each command and writes it in input order.
+    The report file gets a tab-delimited line for each command with its line
+    number, exit code, start and elapsed seconds, and the command.  The exit
+    code is one if any command fails.""")
+  parser.add_argument("-s", "--shell", default="/bin/bash" if os.access("/bin/bash", os.X_OK) else "/bin/sh",
+    help="the path to a shell (default %(default)s)")
+  parser.add_argument("-o", "--ordered", action="store_true",
+    help="write the output of the commands in input order")
+  parser.add_argument("-r", "--report", metavar="FILE", type=argparse.FileType("w"),
+    help="write the exit code and timing of each command to this file")
+  parser.add_argument("limit", type=int,
+    help="the maximum number of concurrent commands")
+  parser.add_argument("input_file", nargs="?",
+    type=argparse.FileType("r"), default=sys.stdin,
+    help="the input commands file (default standard input)")
+  args= parser.parse_args()
+  # Number the lines before skipping blank ones for the report.
+  line_numbers= []
+  def commands():
+    for line_number, line in enumerate(args.input_file, 1):
+      if line.strip():
+        line_numbers.append(line_number)
+        yield line.rstrip("\n")
+  jobs= run(commands(), args.limit, args.shell, args.ordered)
+  if args.report:
+    for job in jobs:
+      print(line_numbers[job.index], job.exit_code, "%.6f" % job.start, "%.6f" % job.elapsed, job.command, sep="\t", file=args.report)
+  if any(job.exit_code for job in jobs):
+    sys.exit(1)
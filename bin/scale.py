@@ -1,12 +1,19 @@
 #!/usr/bin/env python3
 
 import argparse
+import io
+import itertools as it
+import re
+import subprocess
 import sys
 import tempfile
 from collections import defaultdict
 from math import erf, isnan, sqrt
 
 nan= float("NaN")
+SPOOL_SIZE= 64 << 20
+CHUNK_SIZE= 16 << 20
+trailing_zeros= re.compile(r'\.?0+(?=,)')
 
 def as_value(s):
   if s[0] == 'n':
@@ -17,6 +24,35 @@ def as_value(s):
     raise ValueError("unexpected value " + s)
   return .5 + .5 * erf(v / sqrt(2.))
 
+def parse_array(values):
+  # Convert a sequence of strings into an array of floats along with masks
+  # for the ignored and erf-coded values, if any.  Raise ValueError if any
+  # other value is not a number so the caller can fall back to converting one
+  # value at a time.
+  import numpy as np
+  try:
+    return values, np.fromiter(map(float, values), float, len(values)), None, None
+  except ValueError:
+    pass
+  values= np.char.strip(np.array(values))
+  ignored= (values == '') | (values == 'None')
+  coded= np.char.startswith(values, 'p') | np.char.startswith(values, 'n')
+  coded[coded]= [v.lower() != 'nan' for v in values[coded]]
+  floats= np.where(ignored | coded, '0', values).astype(float)
+  return values, floats, ignored, coded
+
+def format_array(values):
+  # Format values as "%g" % round(value, 5) does.  That is the same as "%.5f"
+  # without trailing zeros for values that "%g" shows without an exponent in
+  # at most six digits, which is the usual case, so format those in one call.
+  import numpy as np
+  a= np.abs(values)
+  values= values.tolist()
+  if ((a < 9.99999) & ((a >= 1e-4) | (a < 5e-6))).all():
+    s= ("%.5f," * len(values)) % tuple(values)
+    return trailing_zeros.sub('', s).split(',')[:-1]
+  return ["%g" % round(value, 5) for value in values]
+
 class MinMax:
   def __init__(self, using_negative_one, using_standard_deviation):
     if type(using_negative_one) == str:
@@ -88,6 +124,64 @@ class MinMax:
           result= 2. * result - 1.
     return "%g" % round(result + 1e-9, 5) # Prevent negative zero.
 
+  def add_array(self, values):
+    import numpy as np
+    try:
+      values, floats, ignored, coded= parse_array(values)
+    except ValueError:
+      for value in values:
+        self.add(value)
+      return
+    if coded is None:
+      floats= floats[~np.isnan(floats)]
+    else:
+      for value in values[coded]:
+        # If it's convertible, ignore it.
+        as_value(value)
+      floats= floats[~(ignored | coded | np.isnan(floats))]
+    if not len(floats):
+      return
+    if self.using_standard_deviation:
+      mean= float(floats.mean())
+      self.add_moments(len(floats), mean, float(np.sum((floats - mean) ** 2)))
+    else:
+      self.minimum= min(float(floats.min()), self.minimum)
+      self.maximum= max(float(floats.max()), self.maximum)
+
+  def add_moments(self, k, a, q):
+    # Merge a count, mean, and sum of squared differences into the running
+    # values using the parallel form of Welford's algorithm.
+    if k:
+      diff= a - self.a
+      n= self.k + k
+      self.a += diff * k / n
+      self.q += q + diff * diff * self.k * k / n
+      self.k= n
+
+  def merge(self, other):
+    if self.using_standard_deviation:
+      self.add_moments(other.k, other.a, other.q)
+    elif not isnan(other.minimum):
+      self.minimum= min(other.minimum, self.minimum)
+      self.maximum= max(other.maximum, self.maximum)
+
+  def adjust_array(self, values):
+    import numpy as np
+    try:
+      values, floats, ignored, coded= parse_array(values)
+    except ValueError:
+      return [self.adjust(value) for value in values]
+    result= self.m * floats + self.b
+    if self.wants_clamping:
+      # Use fmin and fmax since they match min and max for NaN.
+      result= np.fmin(np.fmax(result, self.lower_bound), self.upper_bound)
+    if ignored is not None:
+      result[ignored]= self.middle
+    if coded is not None and coded.any():
+      g= map(as_value, values[coded])
+      result[coded]= [2. * v - 1. for v in g] if self.middle == .0 else list(g)
+    return format_array(result + 1e-9)
+
 class MinMaxIgnored:
   def __init__(self):
     pass
@@ -101,6 +195,15 @@ class MinMaxIgnored:
   def adjust(self, value):
     return value
 
+  def add_array(self, values):
+    pass
+
+  def adjust_array(self, values):
+    return values
+
+  def merge(self, other):
+    pass
+
 class MinMaxDict:
   def __init__(self, columns_to_ignore, using_negative_one, using_standard_deviation):
     self.d= {}
@@ -120,23 +223,87 @@ class MinMaxDict:
   def __iter__(self):
     return iter(self.d)
 
-def make_seekable(input_file):
-  # Assign the return value to a variable to prevent the garbage collector
-  # from deleting the temporary file too soon.
-  if input_file.seekable():
-    return input_file, None
-  t= tempfile.TemporaryFile()
-  for line in input_file:
-    t.write(line.encode())
-  t.seek(0)
-  return open(t.fileno()), t
+  def merge(self, other):
+    for k in other:
+      self[k].merge(other[k])
 
-def read_pairs(input_file):
-  for line in input_file:
-    for k, v in enumerate(line.split(',')):
-      yield k, v
+def add_pairs(min_max_dict, line):
+  for k, v in enumerate(line.split(',')):
+    min_max_dict[k].add(v)
 
-def normalize(min_max_dict, input_file, output_file):
+def spool(min_max_dict, input_file, max_size, block_size):
+  # Accumulate the statistics while copying the input into a spool that stays
+  # in memory until it exceeds max_size bytes, when all of it moves to disk.
+  t= tempfile.SpooledTemporaryFile(max_size)
+  def tee():
+    for line in input_file:
+      t.write(line.encode())
+      yield line
+  collect(min_max_dict, tee(), block_size)
+  return read_spool(t)
+
+def read_spool(t):
+  # The generator keeps the spool alive until it is exhausted.
+  with t:
+    t.seek(0)
+    for line in t:
+      yield line.decode()
+
+def read_blocks(input_file, block_size):
+  while True:
+    lines= list(it.islice(input_file, block_size))
+    if not lines:
+      break
+    yield lines
+
+def split_block(lines):
+  # Split a block of lines into columns of values if all of the lines
+  # containing values have the same number of them.
+  rows= [line.split(',') for line in lines if ',' in line]
+  if rows and all(len(row) == len(rows[0]) for row in rows):
+    return list(zip(*rows))
+
+def add_block(min_max_dict, lines):
+  columns= split_block(lines)
+  if columns is None:
+    for line in lines:
+      add_pairs(min_max_dict, line)
+  else:
+    for k, values in enumerate(columns):
+      min_max_dict[k].add_array(values)
+
+def collect(min_max_dict, input_file, block_size=0):
+  if block_size:
+    for lines in read_blocks(input_file, block_size):
+      add_block(min_max_dict, lines)
+  else:
+    for line in input_file:
+      add_pairs(min_max_dict, line)
+
+def reproduce_with(command):
+  # Return a function that runs a shell command reproducing the input.
+  def fn():
+    p= subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, universal_newlines=True)
+    yield from p.stdout
+    if p.wait():
+      raise RuntimeError("reproduce command failed with status %d" % p.returncode)
+  return fn
+
+def normalize_block(min_max_dict, lines):
+  columns= split_block(lines)
+  if columns is None:
+    f= io.StringIO()
+    normalize(min_max_dict, lines, f)
+    return f.getvalue()
+  columns= [min_max_dict[k].adjust_array(values) for k, values in enumerate(columns)]
+  rows= map(",".join, zip(*columns))
+  return "".join(next(rows) + "\n" if ',' in line else "\n" for line in lines)
+
+def normalize(min_max_dict, input_file, output_file, block_size=0):
+  if block_size:
+    for lines in read_blocks(input_file, block_size):
+      output_file.write(normalize_block(min_max_dict, lines))
+    return
   for line in input_file:
     if ',' in line:
       parts= line.split(',')
@@ -145,33 +312,176 @@ def normalize(min_max_dict, input_file, output_file):
     else:
       print(file=output_file)
 
-def save(settings_file, input_file, output_file, columns_to_ignore, using_negative_one, using_standard_deviation):
+def split_ranges(path, count):
+  # Split a file into about count byte ranges that begin at line boundaries.
+  import os
+  size= os.path.getsize(path)
+  offsets= [0]
+  with open(path, 'rb') as fin:
+    for i in range(1, count):
+      fin.seek(max(size * i // count, offsets[-1]))
+      fin.readline()
+      offsets.append(min(fin.tell(), size))
+  offsets.append(size)
+  return [(a, b) for a, b in zip(offsets, offsets[1:]) if a < b]
+
+def read_range(path, start, end):
+  with open(path, 'rb') as fin:
+    fin.seek(start)
+    return io.TextIOWrapper(io.BytesIO(fin.read(end - start)))
+
+def collect_range(args):
+  path, start, end, min_max_dict, block_size= args
+  collect(min_max_dict, read_range(path, start, end), block_size)
+  return min_max_dict
+
+def normalize_range(args):
+  path, start, end, min_max_dict, block_size= args
+  f= io.StringIO()
+  normalize(min_max_dict, read_range(path, start, end), f, block_size)
+  return f.getvalue()
+
+def split_path(input_file):
+  # Return the path of an input file that is a regular file, resolving a
+  # redirected standard input through /proc, or None if there isn't one.
+  import os
+  import stat
+  try:
+    if not input_file.seekable():
+      return None
+    fd= input_file.fileno()
+    st= os.fstat(fd)
+  except (AttributeError, OSError, ValueError):
+    return None
+  if not stat.S_ISREG(st.st_mode):
+    return None
+  for path in (getattr(input_file, "name", None), "/proc/self/fd/%d" % fd):
+    if isinstance(path, str):
+      path= os.path.realpath(path)
+      try:
+        if os.path.samestat(os.stat(path), st):
+          return path
+      except OSError:
+        pass
+  return None
+
+def parallel_collect(min_max_dict, pool, ranges, block_size):
+  # Collect the statistics of each range into an empty copy of the
+  # dictionary and merge them in order.
+  empty= MinMaxDict(min_max_dict.columns_to_ignore, min_max_dict.using_negative_one, min_max_dict.using_standard_deviation)
+  tasks= ((path, start, end, empty, block_size) for path, start, end in ranges)
+  for d in pool.imap(collect_range, tasks):
+    min_max_dict.merge(d)
+
+def parallel_normalize(min_max_dict, pool, ranges, output_file, block_size, jobs):
+  # Scale the ranges with a bounded number of outstanding ranges, writing
+  # them in order.
+  import collections
+  pending= collections.deque()
+  for path, start, end in ranges:
+    pending.append(pool.apply_async(normalize_range, ((path, start, end, min_max_dict, block_size),)))
+    if len(pending) >= 2 * jobs:
+      output_file.write(pending.popleft().get())
+  while pending:
+    output_file.write(pending.popleft().get())
+
+def make_ranges(path, jobs):
+  import os
+  count= max(jobs * 4, os.path.getsize(path) // CHUNK_SIZE)
+  return [(path, start, end) for start, end in split_ranges(path, count)]
+
+def save(settings_file, input_file, output_file, columns_to_ignore, using_negative_one, using_standard_deviation, reproduce=None, spool_size=SPOOL_SIZE, block_size=0, jobs=1):
   import csr
   columns_to_ignore= csr.parse(columns_to_ignore, as_index=True)
   min_max_dict= MinMaxDict(columns_to_ignore, using_negative_one, using_standard_deviation)
-  input_file, input_handle= make_seekable(input_file)
-  for k, v in read_pairs(input_file):
-    min_max_dict[k].add(v)
+  path= split_path(input_file) if jobs > 1 and not reproduce else None
+  if path:
+    # Collect and scale ranges of the input in a pool of processes.
+    import multiprocessing
+    ranges= make_ranges(path, jobs)
+    with multiprocessing.Pool(jobs) as pool:
+      parallel_collect(min_max_dict, pool, ranges, block_size)
+      for k in min_max_dict:
+        print(k, min_max_dict[k], sep=':', file=settings_file)
+      settings_file.flush()
+      parallel_normalize(min_max_dict, pool, ranges, output_file, block_size, jobs)
+    return
+  if reproduce:
+    # Make one pass over the input for the statistics and have the caller
+    # produce it again for scaling.
+    collect(min_max_dict, input_file, block_size)
+    input_file= reproduce()
+  elif input_file.seekable():
+    collect(min_max_dict, input_file, block_size)
+    input_file.seek(0)
+  else:
+    input_file= spool(min_max_dict, input_file, spool_size, block_size)
   for k in min_max_dict:
     print(k, min_max_dict[k], sep=':', file=settings_file)
-  input_file.seek(0)
-  normalize(min_max_dict, input_file, output_file)
+  settings_file.flush()
+  normalize(min_max_dict, input_file, output_file, block_size)
 
-def restore(settings_file, input_file, output_file, wants_clamping):
+def read_settings(settings_file, wants_clamping):
   g= (line.rstrip().split(':') for line in settings_file)
   def make_min_max(s):
     return MinMax(s, wants_clamping) if s else MinMaxIgnored()
-  min_max_dict= {int(p[0]): make_min_max(p[1]) for p in g}
-  normalize(min_max_dict, input_file, output_file)
+  return {int(p[0]): make_min_max(p[1]) for p in g}
+
+def restore(settings_file, input_file, output_file, wants_clamping, block_size=0, jobs=1):
+  min_max_dict= read_settings(settings_file, wants_clamping)
+  path= split_path(input_file) if jobs > 1 else None
+  if path:
+    import multiprocessing
+    with multiprocessing.Pool(jobs) as pool:
+      parallel_normalize(min_max_dict, pool, make_ranges(path, jobs), output_file, block_size, jobs)
+  else:
+    normalize(min_max_dict, input_file, output_file, block_size)
+
+def benchmark(row_count=50000, column_count=20):
+  # Compare the spooled, reproduced, and block save operations on a pipe.
+  import os
+  import random
+  from benchmark import measure, report
+  random.seed(1)
+  path= tempfile.mktemp()
+  with open(path, 'w') as fout:
+    for _ in range(row_count):
+      print(*("%.4f" % random.gauss(0, 9) for _ in range(column_count)), sep=',', file=fout)
+  size= os.path.getsize(path)
+  def run(reproduce, spool_size, block_size):
+    with open(os.devnull, 'w') as fout:
+      p= subprocess.Popen(["cat", path], stdout=subprocess.PIPE, universal_newlines=True)
+      save(io.StringIO(), p.stdout, fout, "", False, False, reproduce, spool_size, block_size)
+  for name, reproduce, spool_size, block_size in [
+      ("spool (memory)", None, size * 2, 0),
+      ("spool (disk)", None, 1, 0),
+      ("reproduce", reproduce_with("cat " + path), 0, 0),
+      ("reproduce (block)", reproduce_with("cat " + path), 0, 4096)]:
+    elapsed, peak_rss= measure(run, reproduce, spool_size, block_size)
+    disk= 0 if reproduce or spool_size > size else size
+    cells= row_count * column_count / elapsed
+    report(name, elapsed, peak_rss, disk_bytes=disk, input_bytes=size, cells_per_second=int(cells))
+  os.remove(path)
 
 if __name__ == "__main__":
+  if "--benchmark" in sys.argv:
+    benchmark()
+    exit(0)
   parser= argparse.ArgumentParser(description="""Scales a CSV dataset so all
     values are in a specific range (default [0, 1]).""", epilog="""You must
     specify either save (-s, --save) or restore (-r, --restore).  The restore
     operation ignores the negative-one, standard-deviation, and ignore options.
     The save operation stores information about those options in the settings
     file.  Only the restore operation uses the clamp option.  Specifying the
-    standard-deviation option results in output that may exceed the range.""")
+    standard-deviation option results in output that may exceed the range.
+    The save operation reads a seekable input file twice.  It collects the
+    statistics from other input while spooling it in memory until it exceeds
+    the spool size, then moving it all to a temporary file, so peak memory is
+    about the spool size and peak disk is zero for input up to the spool size
+    and the input size for larger input.  The reproduce option avoids spooling altogether by running a command that
+    produces the input again for scaling.  The jobs option applies only to
+    input files; it splits them into ranges of lines that it processes in
+    parallel.""")
   parser.add_argument("-s", "--save", metavar="settings_file",
     type=argparse.FileType('w'),
     help="the scaling parameter settings save file")
@@ -186,6 +496,16 @@ if __name__ == "__main__":
     help="use the standard deviation to determine the scaling")
   parser.add_argument("-i", "--ignore", metavar="COLUMNS", default="",
     help="a comma-delimited list of columns to not scale")
+  parser.add_argument("-R", "--reproduce", metavar="COMMAND",
+    help="a shell command that produces the input again for the save operation")
+  parser.add_argument("-m", "--spool-size", metavar="BYTES", type=int,
+    default=SPOOL_SIZE,
+    help="the amount of non-seekable input to spool in memory (default %(default)s)")
+  parser.add_argument("-b", "--block-size", metavar="ROWS", type=int,
+    default=0,
+    help="scale blocks of this many rows at a time using NumPy (default one row at a time)")
+  parser.add_argument("-j", "--jobs", metavar="N", type=int, default=1,
+    help="the number of processes to use for an input file (default %(default)s)")
   parser.add_argument("input_file", nargs="?",
     type=argparse.FileType('r'), default=sys.stdin,
     help="the input data file (default standard input)")
@@ -194,8 +514,9 @@ if __name__ == "__main__":
     help="the scaled output data file (default standard output)")
   args= parser.parse_args()
   if args.save and not args.restore:
-    save(args.save, args.input_file, args.output_file, args.ignore, args.negative_one, args.standard_deviation)
+    reproduce= reproduce_with(args.reproduce) if args.reproduce else None
+    save(args.save, args.input_file, args.output_file, args.ignore, args.negative_one, args.standard_deviation, reproduce, args.spool_size, args.block_size, args.jobs)
   elif args.restore and not args.save:
-    restore(args.restore, args.input_file, args.output_file, args.clamp)
+    restore(args.restore, args.input_file, args.output_file, args.clamp, args.block_size, args.jobs)
   else:
     parser.parse_args(["-h"])
@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
 
 import argparse
+import contextlib
+import math
 import random
 import subprocess
 import sys
 
+BUFFER_SIZE = 1 << 20
+DECK_SIZE = 1000
+
 def doit(subset_size, seed, input_file, output_file, unselected_file):
 	if seed:
 		random.seed(seed)
@@ -17,12 +22,146 @@ def doit(subset_size, seed, input_file, output_file, unselected_file):
 		elif unselected_file:
 			print(line.strip(), file=unselected_file)
 
+def open_binary(f, mode):
+	# Return a buffered binary file for the descriptor of a text file.
+	return open(f.fileno(), mode, buffering=BUFFER_SIZE, closefd=False)
+
+def bernoulli(fraction, rng, input_file, output_file, unselected_file):
+	# Select each line independently with the given probability.
+	for line in input_file:
+		if rng.random() < fraction:
+			output_file.write(line.strip() + b"\n")
+		elif unselected_file:
+			unselected_file.write(line.strip() + b"\n")
+
+def reservoir(sample_count, rng, input_file, output_file, unselected_file):
+	# Select a fixed number of lines using Algorithm L, which skips a random
+	# number of lines between replacements.  Write the selected lines in input
+	# order at the end and the others as they are skipped or replaced.
+	def skip():
+		return math.floor(math.log(1.0 - rng.random()) / math.log(1.0 - w))
+	selected = []
+	w = math.exp(math.log(1.0 - rng.random()) / sample_count) if sample_count else 0.0
+	next_index = sample_count + skip() if sample_count else math.inf
+	for i, line in enumerate(input_file):
+		if i < sample_count:
+			selected.append((i, line))
+		elif i == next_index:
+			j = rng.randrange(sample_count)
+			if unselected_file:
+				unselected_file.write(selected[j][1].strip() + b"\n")
+			selected[j] = (i, line)
+			w *= math.exp(math.log(1.0 - rng.random()) / sample_count)
+			next_index += skip() + 1
+		elif unselected_file:
+			unselected_file.write(line.strip() + b"\n")
+	for _, line in sorted(selected):
+		output_file.write(line.strip() + b"\n")
+
+class Deck:
+	# Deal output indices in proportion to the fractions from shuffled decks
+	# so each class is split in those proportions as closely as the deck size
+	# allows.  The last index, one past the outputs, is the unused remainder.
+	def __init__(self, fractions, rng, size=DECK_SIZE):
+		boundaries = [round(sum(fractions[:i + 1]) * size) for i in range(len(fractions))]
+		self.cards = []
+		for i, (a, b) in enumerate(zip([0] + boundaries, boundaries + [size])):
+			self.cards += [i] * (b - a)
+		self.rng = rng
+		self.hand = []
+
+	def deal(self):
+		if not self.hand:
+			self.hand = self.cards[:]
+			self.rng.shuffle(self.hand)
+		return self.hand.pop()
+
+def split(fractions, seed, input_file, output_files, stratify_column, delimiter, wants_hashing):
+	# Split the input among the output files in one pass, optionally keeping
+	# the proportions of the classes in the stratify column.  Split non-blank
+	# lines without that column as one class and return their line numbers.
+	import zlib
+	rng = random.Random(seed)
+	decks = {}
+	input_file = open_binary(input_file, "rb")
+	output_files = [open_binary(f, "wb") for f in output_files]
+	boundaries = [sum(fractions[:i + 1]) for i in range(len(fractions))]
+	delimiter = delimiter.encode() if delimiter else None
+	salt = str(seed).encode()
+	short_lines = []
+	for line_number, line in enumerate(input_file, 1):
+		line = line.strip()
+		if wants_hashing:
+			# Assign identical lines identically regardless of their position.
+			h = zlib.crc32(line, zlib.crc32(salt)) / 0x100000000
+			i = next((i for i, b in enumerate(boundaries) if h < b), len(boundaries))
+		else:
+			key = None
+			if stratify_column is not None and line:
+				try:
+					key = line.split(delimiter)[stratify_column].strip()
+				except IndexError:
+					if len(short_lines) <= 33:
+						short_lines.append(line_number if len(short_lines) < 33 else "...")
+			deck = decks.get(key)
+			if deck is None:
+				decks[key] = deck = Deck(fractions, rng)
+			i = deck.deal()
+		if i < len(output_files):
+			output_files[i].write(line + b"\n")
+	for f in output_files:
+		f.flush()
+	return short_lines
+
+def stream(subset_size, seed, input_file, output_file, unselected_file):
+	# Select lines in a single pass, which works for pipes as well as files.
+	rng = random.Random(seed)
+	input_file = open_binary(input_file, "rb")
+	output_file = open_binary(output_file, "wb")
+	unselected_file = unselected_file and open_binary(unselected_file, "wb")
+	if subset_size[-1] == '%':
+		bernoulli(float(subset_size[:-1]) / 100, rng, input_file, output_file, unselected_file)
+	else:
+		reservoir(int(subset_size), rng, input_file, output_file, unselected_file)
+	output_file.flush()
+	unselected_file and unselected_file.flush()
+
 if __name__ == "__main__":
-	parser = argparse.ArgumentParser(description="Selects a random subset of a dataset in any line-oriented format.")
+	parser = argparse.ArgumentParser(description="Selects a random subset of a dataset in any line-oriented format.",
+		epilog="""The single-pass option selects each line with the given
+		percentage, so the number of selected lines varies, or keeps a reservoir
+		of the given number of lines, writing unselected lines as it replaces
+		them.  It applies automatically when reading standard input.  The split
+		option reads the input once, writing each line to one of its files or,
+		if the percentages total less than 100, to none of them.""")
 	parser.add_argument("-s", "--seed", type=int, help="the random seed")
-	parser.add_argument("input_file", type=argparse.FileType('r'), help="the input data file")
+	parser.add_argument("-1", "--single-pass", action="store_true", help="read the input once without counting its lines")
+	parser.add_argument("-k", "--split", metavar="FILES", help="split the input among these comma-delimited files by the comma-delimited percentages of the subset size")
+	parser.add_argument("-t", "--stratify", type=int, metavar="N", help="split each class in this column number (negative from the end) in the same proportions")
+	parser.add_argument("-d", "--delimiter", metavar="C", help="column delimiter character for stratifying (default whitespace)")
+	parser.add_argument("-H", "--hash", action="store_true", help="split by a hash of each line instead of at random")
+	parser.add_argument("input_file", type=argparse.FileType('r'), help="the input data file ('-' for standard input)")
 	parser.add_argument("subset_size", help="the number of lines (or a percentage) to select")
 	parser.add_argument("output_file", nargs="?", type=argparse.FileType('w'), default=sys.stdout, help="the selected data (default stdout)")
 	parser.add_argument("unselected_file", nargs="?", type=argparse.FileType('w'), help="the rest of the input (default /dev/null)")
 	args = parser.parse_args()
-	doit(args.subset_size, args.seed, args.input_file, args.output_file, args.unselected_file)
+	if args.split:
+		paths = args.split.split(',')
+		fractions = [float(s.rstrip('%')) / 100 for s in args.subset_size.split(',')]
+		if len(fractions) != len(paths) or sum(fractions) > 1.000001:
+			parser.error("specify one percentage per split file totaling at most 100")
+		if args.stratify == 0:
+			parser.error("column numbers start at one")
+		if args.stratify and args.hash:
+			parser.error("cannot both stratify and hash")
+		with contextlib.ExitStack() as stack:
+			output_files = [stack.enter_context(open(path, "w")) for path in paths]
+			stratify_column = args.stratify - 1 if args.stratify and args.stratify > 0 else args.stratify
+			short_lines = split(fractions, args.seed, args.input_file, output_files, stratify_column, args.delimiter, args.hash)
+		if short_lines:
+			print("warning:  no column %d in lines %s" % (args.stratify, ", ".join(map(str, short_lines))), file=sys.stderr)
+			exit(1)
+	elif args.single_pass or args.input_file is sys.stdin:
+		stream(args.subset_size, args.seed, args.input_file, args.output_file, args.unselected_file)
+	else:
+		doit(args.subset_size, args.seed, args.input_file, args.output_file, args.unselected_file)
@@ -3,8 +3,12 @@
 import argparse
 import io
 import itertools
+import os
 import sys
 
+BLOCK_SIZE = 4096
+CHUNK_SIZE = 16 << 20
+
 def parse_line(line, column_count):
 	line = line.strip()
 	parts = line.split()
@@ -25,9 +29,80 @@ def parse_line(line, column_count):
 	values[-1] = target
 	return values
 
-def doit(input_file, output_file, feature_count):
+def scan_feature_count(input_file):
+	# Find the largest feature index in the file without parsing its lines.
+	import mmap
+	import re
+	pattern = re.compile(rb'\s(\d+):')
+	feature_count = 0
+	if os.fstat(input_file.fileno()).st_size == 0:
+		return feature_count
+	with mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as m:
+		start = 0
+		while start < len(m):
+			end = m.find(b'\n', start + CHUNK_SIZE)
+			end = len(m) if end < 0 else end + 1
+			feature_count = max(feature_count, max(map(int, pattern.findall(m[start:end])), default=0))
+			start = end
+	return feature_count
+
+def write_rows(input_file, output_file, column_count, has_bad_data):
+	# Fill a reused row for each line, restoring only the values it set, and
+	# write blocks of lines at once.
+	values = ['0'] * column_count
+	lines = []
+	for line_index, line in enumerate(input_file):
+		parts = line.split()
+		if column_count < len(parts):
+			add_bad_data(has_bad_data, line_index + 1)
+			continue
+		indices = []
+		for feature in parts[1:]:
+			column, value = feature.split(':', 1)
+			i = int(column) - 1
+			values[i] = value
+			indices.append(i)
+		values[-1] = parts[0]
+		lines.append(",".join(values))
+		for i in indices:
+			values[i] = '0'
+		if len(lines) == BLOCK_SIZE:
+			lines.append("")
+			output_file.write("\n".join(lines))
+			lines = []
+	if lines:
+		lines.append("")
+		output_file.write("\n".join(lines))
+
+def add_bad_data(has_bad_data, line_number):
+	if len(has_bad_data) < 22:
+		has_bad_data.append(line_number)
+	elif len(has_bad_data) == 22:
+		has_bad_data.append("...")
+
+def doit(input_file, output_file, feature_count, wants_scan=False, wants_cache=False, wants_binary=False, precision=7):
+	# Use a binary dataset if given one or asked to write one, caching the
+	# input if asked.  Convert LIBSVM text to CSV text directly since a
+	# dataset does not keep the text of the values.
+	import dataset
+	d = dataset.open_input(input_file, "svm", dataset.read_svm, wants_cache and wants_binary)
+	if d is None and wants_binary:
+		d = dataset.read_svm(input_file)
+	if d is not None:
+		if wants_binary:
+			dataset.write_output(d, output_file)
+		else:
+			dataset.write_csv(d, output_file, "%%.%dg" % precision, max(feature_count, 0))
+		return
+
+	if wants_scan:
+		feature_count = scan_feature_count(input_file)
+		print("using", feature_count, "as feature count", file=sys.stderr)
 	column_count = feature_count + 1
 	has_bad_data = []
+	if column_count:
+		write_rows(input_file, output_file, column_count, has_bad_data)
+		input_file = ()
 	for line_index, line in enumerate(input_file):
 		parts = parse_line(line, column_count)
 		if column_count == 0:
@@ -35,21 +110,32 @@ def doit(input_file, output_file, feature_count):
 			print("using", column_count - 1, "as feature count", file=sys.stderr)
 		if column_count == len(parts):
 			print(*parts, sep=',', file=output_file)
-		elif len(has_bad_data) < 22:
-			has_bad_data.append(line_index + 1)
-		elif len(has_bad_data) == 22:
-			has_bad_data.append("...")
+		else:
+			add_bad_data(has_bad_data, line_index + 1)
 	if has_bad_data:
 		print("warning:  feature count not", column_count - 1, "in lines", has_bad_data, file=sys.stderr)
 
 if __name__ == "__main__":
 	parser = argparse.ArgumentParser(
 		description="Creates CSV data from LIBSVM data.",
-		epilog="The target is in the last column.")
+		epilog="""The target is in the last column.  Without the feature count,
+		the first row determines it unless scanning the input file.  The input
+		may be a binary dataset, in which case the precision is the number of
+		significant figures.  The cache option applies only to binary output;
+		CSV output keeps the text of the values, so it is always converted
+		from the LIBSVM text.""")
 	parser.add_argument("-f", "--feature-count", type=int, default=-1,
 		help="the number of features (if the first row doesn't contain all features)")
+	parser.add_argument("-a", "--scan", action="store_true",
+		help="scan the input file for the largest feature index to use as the feature count")
+	parser.add_argument("-C", "--cache", action="store_true",
+		help="cache the parsed input file as a binary dataset for binary output")
+	parser.add_argument("-b", "--binary", action="store_true",
+		help="write a binary dataset instead of CSV data")
 	parser.add_argument("-p", "--precision", default=7, type=int, help="number of digits after the decimal (default %(default)s)")
 	parser.add_argument("input_file", nargs="?", type=argparse.FileType('r'), default=sys.stdin)
 	parser.add_argument("output_file", nargs="?", type=argparse.FileType('w'), default=sys.stdout)
 	args = parser.parse_args()
-	doit(args.input_file, args.output_file, args.feature_count)
+	if args.scan and not args.input_file.seekable():
+		parser.error("scanning requires an input file")
+	doit(args.input_file, args.output_file, args.feature_count, args.scan, args.cache, args.binary, args.precision)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+
+BIN_DIRECTORY= os.path.dirname(os.path.abspath(__file__))
+LIB_DIRECTORY= os.path.join(os.path.dirname(BIN_DIRECTORY), "lib")
+BUDGET= 0.25
+REPEAT_COUNT= 5
+
+def tool_names():
+  this= os.path.basename(__file__)
+  return sorted(name[:-3] for name in os.listdir(BIN_DIRECTORY) if name.endswith(".py") and name != this)
+
+def tool_path(name):
+  name= name if name.endswith(".py") else name + ".py"
+  path= os.path.join(BIN_DIRECTORY, name)
+  if os.path.basename(name) != name or name == os.path.basename(__file__) or not os.path.isfile(path):
+    raise ValueError("unknown tool {}".format(name))
+  return path
+
+def use_lib():
+  # Make the modules in lib available to the tool and its child processes
+  # without relying on the caller's PYTHONPATH.
+  if LIB_DIRECTORY not in sys.path:
+    sys.path.insert(0, LIB_DIRECTORY)
+  paths= os.environ.get("PYTHONPATH", "").split(os.pathsep)
+  if LIB_DIRECTORY not in paths:
+    os.environ["PYTHONPATH"]= os.pathsep.join([LIB_DIRECTORY] + [p for p in paths if p])
+
+def run(name, args):
+  """Runs a tool as the main module, importing only what it imports."""
+  import runpy
+  path= tool_path(name)
+  use_lib()
+  sys.path.insert(0, BIN_DIRECTORY)
+  sys.argv= [path] + list(args)
+  runpy.run_path(path, run_name="__main__")
+
+def import_time(name, args, count=20):
+  """Runs a tool with -X importtime and prints the imports with the largest
+    cumulative times to standard error.  It passes through the tool's own
+    standard error and returns its exit code."""
+  import subprocess
+  p= subprocess.run([sys.executable, "-X", "importtime", os.path.abspath(__file__), name] + list(args),
+    stderr=subprocess.PIPE, universal_newlines=True)
+  imports= []
+  for line in p.stderr.splitlines():
+    if line.startswith("import time:"):
+      parts= line[len("import time:"):].split("|")
+      if parts[0].strip().isdigit():
+        self_us, cumulative_us, module= int(parts[0]), int(parts[1]), parts[2].rstrip()
+        imports.append((cumulative_us, self_us, module))
+    else:
+      print(line, file=sys.stderr)
+  # Nested imports have more than one space before their names.
+  total= sum(c for c, _, m in imports if len(m) - len(m.lstrip()) == 1)
+  print("{:>12} {:>12}  {}".format("cumulative", "self", "module (microseconds)"), file=sys.stderr)
+  for cumulative_us, self_us, module in sorted(imports, reverse=True)[:count]:
+    print("{:12d} {:12d} {}".format(cumulative_us, self_us, module), file=sys.stderr)
+  print("{:12d} {:>12}  total of top-level imports".format(total, ""), file=sys.stderr)
+  return p.returncode
+
+def cold_start(argv):
+  # Run a command with its output discarded and return its elapsed time,
+  # peak resident set size, and exit code.
+  import time
+  start= time.perf_counter()
+  pid= os.fork()
+  if pid == 0:
+    try:
+      fd= os.open(os.devnull, os.O_RDWR)
+      for target in (0, 1, 2):
+        os.dup2(fd, target)
+      os.execv(argv[0], argv)
+    finally:
+      os._exit(127)
+  _, status, usage= os.wait4(pid, 0)
+  return time.perf_counter() - start, usage.ru_maxrss, os.waitstatus_to_exitcode(status)
+
+def benchmark(names, budget=BUDGET, repeat_count=REPEAT_COUNT):
+  """Measures the median cold start time of each tool showing its help and
+    returns the names of those over budget."""
+  use_lib()
+  from benchmark import report
+  over= []
+  for name in names or tool_names():
+    argv= [sys.executable, os.path.abspath(__file__), name, "--help"]
+    results= sorted(cold_start(argv) for _ in range(repeat_count))
+    elapsed, peak_rss, exit_code= results[len(results) // 2]
+    is_over= elapsed > budget or exit_code != 0
+    report(name, elapsed, peak_rss, exit_code=exit_code, budget=budget, over="yes" if is_over else "no")
+    if is_over:
+      over.append(name)
+  return over
+
+if __name__ == "__main__":
+  parser= argparse.ArgumentParser(description="Runs the tools in bin as subcommands.",
+    epilog="""The tool is the name of a script in bin with or without its .py
+    suffix.  It runs in this process with lib added to the module path, so it
+    imports only the modules its code path needs.  The import time option
+    runs it with -X importtime and reports the slowest imports.  The benchmark
+    option measures the median cold start of each named tool (default all)
+    showing its help and exits with status one if any exceeds the budget.""")
+  parser.add_argument("-l", "--list", action="store_true",
+    help="list the tools")
+  parser.add_argument("-i", "--import-time", action="store_true",
+    help="report the import times of the tool")
+  parser.add_argument("-b", "--benchmark", action="store_true",
+    help="measure the cold start time of the tools")
+  parser.add_argument("-t", "--budget", metavar="SECONDS", type=float, default=BUDGET,
+    help="the cold start budget for the benchmark (default %(default)s)")
+  parser.add_argument("-n", "--repeat", metavar="N", type=int, default=REPEAT_COUNT,
+    help="the number of cold starts per tool for the benchmark (default %(default)s)")
+  parser.add_argument("tool", nargs="?",
+    help="the tool to run")
+  parser.add_argument("args", nargs=argparse.REMAINDER,
+    help="the arguments of the tool")
+  args= parser.parse_args()
+  if args.list:
+    print(*tool_names(), sep="\n")
+  elif args.benchmark:
+    names= [args.tool] + args.args if args.tool else []
+    if benchmark(names, args.budget, args.repeat):
+      sys.exit(1)
+  elif not args.tool:
+    parser.error("the tool is required")
+  elif args.import_time:
+    sys.exit(import_time(args.tool, args.args))
+  else:
+    try:
+      tool_path(args.tool)
+    except ValueError as ex:
+      parser.error(str(ex))
+    run(args.tool, args.args)
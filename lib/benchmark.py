@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+import traceback
+
+def measure(fn, *args):
+  """Runs fn(*args) in a child process and returns a tuple of the elapsed
+    time in seconds and the peak resident set size of the child in
+    kilobytes."""
+  start= time.perf_counter()
+  pid= os.fork()
+  if pid == 0:
+    status= 0
+    try:
+      fn(*args)
+    except BaseException:
+      traceback.print_exc()
+      status= 1
+    os._exit(status)
+  _, status, usage= os.wait4(pid, 0)
+  elapsed= time.perf_counter() - start
+  status= os.waitstatus_to_exitcode(status)
+  if status:
+    raise RuntimeError("benchmark child failed with status %d" % status)
+  return elapsed, usage.ru_maxrss
+
+def report(name, elapsed, peak_rss, **kwargs):
+  """Prints a benchmark result line to standard error."""
+  extra= "".join(" %s=%s" % p for p in kwargs.items())
+  print("%-24s %8.3fs %8dKB%s" % (name, elapsed, peak_rss, extra), file=sys.stderr)
+
+def load_history(path):
+  """Returns the list of runs recorded in a JSON history file."""
+  import json
+  try:
+    with open(path) as fin:
+      return json.load(fin)
+  except FileNotFoundError:
+    return []
+
+def save_history(path, history):
+  """Writes the list of runs to a JSON history file, replacing it whole."""
+  import json
+  temporary_path= path + ".tmp"
+  with open(temporary_path, "w") as fout:
+    json.dump(history, fout, indent=1, sort_keys=True)
+  os.replace(temporary_path, path)
+
+def regressions(history, results, threshold, run_count=5):
+  """Compares each result with the median of the same metric in the last
+    run_count runs of the history that have it and returns a list of
+    (key, metric, value, baseline) tuples for those worse by more than the
+    threshold fraction.  Metrics ending in "per_second" are better higher;
+    the others are better lower."""
+  found= []
+  for key, metrics in sorted(results.items()):
+    for metric, value in sorted(metrics.items()):
+      previous= [run["results"][key][metric] for run in history if metric in run["results"].get(key, {})][-run_count:]
+      if not previous:
+        continue
+      baseline= sorted(previous)[len(previous) // 2]
+      if metric.endswith("per_second"):
+        is_worse= value < baseline * (1 - threshold)
+      else:
+        is_worse= value > baseline * (1 + threshold)
+      if is_worse:
+        found.append((key, metric, value, baseline))
+  return found
@@ -0,0 +1,91 @@
+import array
+import itertools as it
+import math
+
+BLOCK_SIZE= 4096
+
+def to_floats(values):
+  """Converts strings to an array of floats, with NaN for empty strings."""
+  try:
+    return array.array('d', map(float, values))
+  except ValueError:
+    return array.array('d', (float(s) if s.strip() else math.nan for s in values))
+
+def blocks(lines, indices=None, delimiter=None, key_index=None, block_size=BLOCK_SIZE):
+  """Splits blocks of lines, yielding for each block a list of the values in
+    the key column (or None) and an array of floats for each selected column.
+    Only the selected columns are kept and converted.  Without indices, it
+    selects all columns of the first line except the key column."""
+  lines= iter(lines)
+  for block in iter(lambda: list(it.islice(lines, block_size)), []):
+    rows= [line.strip().split(delimiter) for line in block]
+    if indices is None:
+      indices= tuple(i for i in range(len(rows[0])) if i != key_index)
+    wanted= list(indices) + ([] if key_index is None else [key_index])
+    width= max(wanted) + 1 if wanted else 0
+    for row in rows:
+      if len(row) < width:
+        row.extend([''] * (width - len(row)))
+    keys= [row[key_index] for row in rows] if key_index is not None else None
+    yield keys, [to_floats([row[i] for row in rows]) for i in indices]
+
+def read(lines, indices=None, delimiter=None, key_index=None, block_size=BLOCK_SIZE):
+  """Returns a list of the values in the key column (or None) and an array
+    of floats for each selected column of the lines.  Memory depends on the
+    number of selected columns, not the number of columns in the lines."""
+  keys, columns= None, None
+  for block_keys, block_columns in blocks(lines, indices, delimiter, key_index, block_size):
+    if columns is None:
+      keys, columns= block_keys, block_columns
+    else:
+      if keys is not None:
+        keys.extend(block_keys)
+      for column, block_column in zip(columns, block_columns):
+        column.extend(block_column)
+  return keys, columns
+
+class Aggregate:
+  """Sums the values of each selected column, ignoring NaN, for the rows
+    with each key as blocks of them arrive, keeping the keys in order of
+    appearance."""
+  def __init__(self):
+    self.keys= {}
+    self.sums= None
+    self.counts= None
+
+  def add(self, keys, columns):
+    if self.sums is None:
+      self.sums= [array.array('d') for _ in columns]
+      self.counts= [array.array('d') for _ in columns]
+    codes= []
+    for key in keys:
+      code= self.keys.get(key)
+      if code is None:
+        code= self.keys[key]= len(self.keys)
+        for sums, counts in zip(self.sums, self.counts):
+          sums.append(0.0)
+          counts.append(0.0)
+      codes.append(code)
+    for sums, counts, column in zip(self.sums, self.counts, columns):
+      for code, value in zip(codes, column):
+        if value == value:
+          sums[code] += value
+          counts[code] += 1
+
+  def result(self, how="sum"):
+    """Returns the keys and an array of the sum or mean of each column for
+      them."""
+    if how == "mean":
+      columns= [array.array('d', (s / c if c else math.nan for s, c in zip(sums, counts)))
+        for sums, counts in zip(self.sums or [], self.counts or [])]
+    else:
+      columns= self.sums or []
+    return list(self.keys), columns
+
+def aggregate(lines, indices=None, delimiter=None, key_index=None, how="sum", block_size=BLOCK_SIZE):
+  """Returns the keys in the key column and an array of the sum or mean of
+    each selected column of the lines with each key."""
+  a= Aggregate()
+  for keys, columns in blocks(lines, indices, delimiter, key_index, block_size):
+    a.add(keys, columns)
+  return a.result(how)
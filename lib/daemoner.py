@@ -3,6 +3,7 @@
 import argparse
 from atexit import register as on_exit
 import os
+import tempfile
 from signal import signal, SIGTERM
 import sys
 
@@ -74,13 +75,14 @@ def stop(pid_file_path):
       os.kill(int(fin.read()), SIGTERM)
       return True
 
-def main(daemon_name, fn, parameters, argparser=None):
+def main(daemon_name, fn, parameters, argparser=None, pid_file_path=None):
+  pid_file_path= pid_file_path or os.path.join(tempfile.gettempdir(), "{}.pid".format(daemon_name))
   parser= argparser or argparse.ArgumentParser(description="Control the {} daemon.".format(daemon_name))
   parser.add_argument("action", choices=["start", "stop"],
       help="start or stop the service")
   args= parser.parse_args()
   if args.action == "start":
-    start(pid_file_path, fn, argparser, parameters)
+    start(pid_file_path, fn, args, parameters)
   elif not stop(pid_file_path):
     print("Daemon {} not running".format(daemon_name), file=sys.stderr)
     sys.exit(1)
@@ -0,0 +1,242 @@
+import hashlib
+import json
+import os
+import sys
+
+MAGIC= b"DATASET1"
+ALIGNMENT= 64
+CHUNK_ROWS= 1 << 16
+
+class Dataset:
+  """Holds targets and features parsed from a text dataset.  The features
+    are either a dense array or compressed sparse row (CSR) arrays."""
+  def __init__(self, y, column_count, x=None, data=None, indices=None, indptr=None, bad_lines=None):
+    self.y= y
+    self.column_count= column_count
+    self.x= x
+    self.data= data
+    self.indices= indices
+    self.indptr= indptr
+    self.bad_lines= bad_lines
+
+  @property
+  def is_sparse(self):
+    return self.x is None
+
+  def __len__(self):
+    return len(self.y)
+
+  def arrays(self):
+    if self.is_sparse:
+      arrays= {"y": self.y, "data": self.data, "indices": self.indices, "indptr": self.indptr}
+    else:
+      arrays= {"y": self.y, "x": self.x}
+    if self.bad_lines is not None:
+      arrays["bad_lines"]= self.bad_lines
+    return arrays
+
+  def dense(self):
+    """Returns the features as a dense array."""
+    import numpy as np
+    if not self.is_sparse:
+      return self.x
+    x= np.zeros((len(self.y), self.column_count))
+    rows= np.repeat(np.arange(len(self.y)), np.diff(self.indptr))
+    x[rows, self.indices]= self.data
+    return x
+
+  def rows(self):
+    """Yields the target and the column indices and values of the nonzero
+      features of each row."""
+    import numpy as np
+    if self.is_sparse:
+      indptr= self.indptr.tolist()
+      for i, target in enumerate(self.y.tolist()):
+        a, b= indptr[i], indptr[i + 1]
+        yield target, self.indices[a:b].tolist(), self.data[a:b].tolist()
+    else:
+      for target, row in zip(self.y.tolist(), self.x):
+        indices= np.flatnonzero(row)
+        yield target, indices.tolist(), row[indices].tolist()
+
+def read_csv(input_file, target_index=-1, skip_first=False, chunk_rows=CHUNK_ROWS):
+  """Parses CSV lines of numbers into a dense dataset.  Lines without a comma
+    are skipped, as are lines with parts that are not numbers or a different
+    number of parts than the first line; the dataset records the numbers of
+    the latter in bad_lines.  It parses chunk_rows lines at a time into
+    temporary files and memory-maps them, so memory does not grow with the
+    input."""
+  import itertools as it
+  import tempfile
+  import numpy as np
+  from quoted_line import parse as parse_line
+  if skip_first:
+    next(input_file, None)
+  lines= enumerate(input_file, 2 if skip_first else 1)
+  x_file, y_file= tempfile.TemporaryFile(), tempfile.TemporaryFile()
+  row_count= width= 0
+  bad_lines= []
+  for chunk in iter(lambda: list(it.islice(lines, chunk_rows)), []):
+    rows= []
+    for line_number, line in chunk:
+      if ',' not in line:
+        continue
+      parts= parse_line(line, ',')
+      try:
+        if width and len(parts) != width:
+          raise ValueError("ragged line")
+        rows.append([float(part) for part in parts])
+        width= len(parts)
+      except ValueError:
+        bad_lines.append(line_number)
+    if rows:
+      a= np.array(rows)
+      y_file.write(a[:, target_index].tobytes())
+      x_file.write(np.delete(a, target_index % width, 1).tobytes())
+      row_count += len(rows)
+  bad_lines= np.array(bad_lines, dtype=np.int64)
+  if not row_count:
+    return Dataset(np.zeros(0), 0, x=np.zeros((0, 0)), bad_lines=bad_lines)
+  x_file.flush()
+  y_file.flush()
+  x= np.memmap(x_file, float, 'r', shape=(row_count, width - 1))
+  y= np.memmap(y_file, float, 'r', shape=(row_count,))
+  return Dataset(y, width - 1, x=x, bad_lines=bad_lines)
+
+def report_bad_lines(dataset, error_file=None):
+  """Warns of the lines read_csv skipped, listing at most 33 of them, and
+    returns whether there were none."""
+  if dataset.bad_lines is None or not len(dataset.bad_lines):
+    return True
+  l= [str(n) for n in dataset.bad_lines[:33].tolist()] + (["..."] if len(dataset.bad_lines) > 33 else [])
+  print("warning:  bad data in lines " + ", ".join(l), file=error_file or sys.stderr)
+  return False
+
+def read_svm(input_file):
+  """Parses LIBSVM lines into a sparse dataset."""
+  import numpy as np
+  y, data, indices, indptr= [], [], [], [0]
+  for line in input_file:
+    parts= line.split()
+    if not parts:
+      continue
+    y.append(float(parts[0]))
+    for feature in parts[1:]:
+      column, value= feature.split(':', 1)
+      indices.append(int(column) - 1)
+      data.append(float(value))
+    indptr.append(len(indices))
+  column_count= max(indices) + 1 if indices else 0
+  return Dataset(np.array(y), column_count, data=np.array(data),
+    indices=np.array(indices, dtype=np.int64), indptr=np.array(indptr, dtype=np.int64))
+
+def write_csv(dataset, output_file, fmt="%.7g", column_count=None):
+  """Writes the features of each row followed by its target as CSV."""
+  column_count= column_count or dataset.column_count
+  for target, indices, values in dataset.rows():
+    parts= ['0'] * (column_count + 1)
+    for i, value in zip(indices, values):
+      parts[i]= fmt % value
+    parts[-1]= fmt % target
+    print(*parts, sep=',', file=output_file)
+
+def write_svm(dataset, output_file, fmt="%.7g"):
+  """Writes the target and nonzero features of each row as LIBSVM."""
+  for target, indices, values in dataset.rows():
+    output_line= fmt % target
+    for i, value in zip(indices, values):
+      value= fmt % value
+      if value != "0":
+        output_line += " {}:{}".format(i + 1, value)
+    print(output_line, file=output_file)
+
+def save(dataset, output_file, source=None, key=""):
+  """Writes a dataset in binary form.  The header records the source file
+    path, modification time, and size and the key of the parser options so
+    the file can serve as a cache."""
+  import numpy as np
+  arrays= dataset.arrays()
+  offset= 0
+  layout= {}
+  for name, a in arrays.items():
+    layout[name]= [a.dtype.str, a.shape, offset]
+    offset += -(-a.nbytes // ALIGNMENT) * ALIGNMENT
+  header= json.dumps({"column_count": dataset.column_count, "source": source, "key": key, "arrays": layout}).encode()
+  header += b' ' * (-(len(MAGIC) + 8 + len(header)) % ALIGNMENT)
+  output_file.write(MAGIC)
+  output_file.write(len(header).to_bytes(8, "little"))
+  output_file.write(header)
+  for name, a in arrays.items():
+    a= np.ascontiguousarray(a)
+    if a.nbytes:
+      output_file.write(memoryview(a).cast('B'))
+    output_file.write(b'\0' * (-a.nbytes % ALIGNMENT))
+
+def read_header(path):
+  with open(path, "rb") as fin:
+    if fin.read(len(MAGIC)) != MAGIC:
+      return None, 0
+    n= int.from_bytes(fin.read(8), "little")
+    return json.loads(fin.read(n)), len(MAGIC) + 8 + n
+
+def load(path):
+  """Memory-maps a binary dataset."""
+  import numpy as np
+  header, base= read_header(path)
+  if header is None:
+    raise ValueError("not a binary dataset: " + path)
+  arrays= {}
+  for name, (dtype, shape, offset) in header["arrays"].items():
+    if np.prod(shape, dtype=int):
+      arrays[name]= np.memmap(path, dtype, 'r', base + offset, tuple(shape))
+    else:
+      arrays[name]= np.zeros(shape, dtype)
+  return Dataset(column_count=header["column_count"], **arrays)
+
+def is_dataset(input_file):
+  """Determines whether an open file is a binary dataset."""
+  path= getattr(input_file, "name", None)
+  if not isinstance(path, str) or not os.path.isfile(path):
+    return False
+  with open(path, "rb") as fin:
+    return fin.read(len(MAGIC)) == MAGIC
+
+def get_source(path):
+  s= os.stat(path)
+  return [os.path.abspath(path), s.st_mtime_ns, s.st_size]
+
+def cache_path(path, key):
+  directory= os.environ.get("DATASET_CACHE") or os.path.join(os.path.expanduser("~"), ".cache", "dataset")
+  name= hashlib.sha1((os.path.abspath(path) + "\0" + key).encode()).hexdigest()
+  return os.path.join(directory, name)
+
+def cached(path, key, reader):
+  """Returns the dataset for a file from the cache, parsing it with reader
+    and caching the result if the file changed since it was cached."""
+  source= get_source(path)
+  cache_file_path= cache_path(path, key)
+  if os.path.exists(cache_file_path):
+    header, _= read_header(cache_file_path)
+    if header and header["source"] == source and header["key"] == key:
+      return load(cache_file_path)
+  with open(path) as fin:
+    dataset= reader(fin)
+  os.makedirs(os.path.dirname(cache_file_path), exist_ok=True)
+  temporary_path= "%s.%d" % (cache_file_path, os.getpid())
+  with open(temporary_path, "wb") as fout:
+    save(dataset, fout, source, key)
+  os.replace(temporary_path, cache_file_path)
+  return dataset
+
+def open_input(input_file, key, reader, wants_cache):
+  """Returns the dataset for an input file if it is a binary dataset or if
+    caching is requested for a regular file; otherwise, returns None."""
+  if is_dataset(input_file):
+    return load(input_file.name)
+  if wants_cache and isinstance(getattr(input_file, "name", None), str) and os.path.isfile(input_file.name):
+    return cached(input_file.name, key, reader)
+
+def write_output(dataset, output_file):
+  """Writes a binary dataset to an open text or binary file."""
+  output_file.flush()
+  save(dataset, getattr(output_file, "buffer", output_file))
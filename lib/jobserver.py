@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+"""Runs the scripts in bin in a pool of forked workers that have already
+  imported the modules the scripts use, so a job does not pay for starting
+  Python and importing numpy, scipy, and pygal.
+
+  A client connects to the server's Unix domain socket and sends a JSON line
+  with the script name, its arguments, and the client's working directory,
+  umask, and environment along with its standard input, output, and error
+  file descriptors.  A
+  worker runs the script with those descriptors and replies with a JSON line
+  holding its exit code.  Each worker runs one job and exits, and the server
+  forks a replacement, so jobs cannot affect each other."""
+
+import json
+import os
+import socket
+import sys
+
+WARM_MODULES= ("numpy", "scipy.optimize", "scipy.sparse", "pygal")
+WORKER_COUNT= os.cpu_count() or 1
+MAX_MESSAGE_SIZE= 1 << 16
+
+def default_socket_path():
+  import tempfile
+  return os.environ.get("JOB_SERVER_SOCKET") or os.path.join(tempfile.gettempdir(), "job-server-{}.sock".format(os.getuid()))
+
+def warm(modules=WARM_MODULES):
+  """Imports the modules, skipping those that are not installed."""
+  import importlib
+  for name in modules:
+    try:
+      importlib.import_module(name)
+    except ImportError:
+      pass
+
+def serve(socket_path, tools_directory, worker_count=WORKER_COUNT, modules=WARM_MODULES):
+  """Listens on socket_path and keeps worker_count workers waiting for jobs
+    until terminated."""
+  from signal import signal, SIGTERM, SIG_DFL
+  warm(modules)
+  sys.path.insert(0, tools_directory)
+  if os.path.exists(socket_path):
+    os.remove(socket_path)
+  # Create the socket accessible only to this user, since a job runs with
+  # this user's privileges.
+  listener= socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  mask= os.umask(0o177)
+  try:
+    listener.bind(socket_path)
+  finally:
+    os.umask(mask)
+  os.chmod(socket_path, 0o600)
+  listener.listen(128)
+  workers= set()
+  try:
+    while True:
+      while len(workers) < worker_count:
+        pid= os.fork()
+        if pid == 0:
+          signal(SIGTERM, SIG_DFL)
+          status= 1
+          try:
+            status= work(listener, tools_directory)
+          finally:
+            os._exit(status)
+        workers.add(pid)
+      pid, _= os.wait()
+      workers.discard(pid)
+  finally:
+    for pid in workers:
+      try:
+        os.kill(pid, SIGTERM)
+      except ProcessLookupError:
+        pass
+    listener.close()
+    os.remove(socket_path)
+
+def work(listener, tools_directory):
+  # Accept one job, run it, and reply with its exit code.
+  import struct
+  connection, _= listener.accept()
+  listener.close()
+  with connection:
+    # Refuse clients running as other users before accepting their
+    # descriptors.
+    credentials= connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    _, uid, _= struct.unpack("3i", credentials)
+    if uid != os.getuid():
+      print("refusing job from uid {}".format(uid), file=sys.stderr)
+      return 1
+    message, fds, _, _= socket.recv_fds(connection, MAX_MESSAGE_SIZE, 3)
+    while not message.endswith(b"\n"):
+      data= connection.recv(MAX_MESSAGE_SIZE)
+      if not data:
+        return 1
+      message += data
+    exit_code= run(json.loads(message), fds, tools_directory)
+    connection.sendall(json.dumps({"exit_code": exit_code}).encode() + b"\n")
+  return 0
+
+def run(request, fds, tools_directory):
+  # Run a script as the main module with the client's standard streams and
+  # working directory, returning its exit code.
+  import runpy
+  import traceback
+  for fd, target in zip(fds, (0, 1, 2)):
+    os.dup2(fd, target)
+    os.close(fd)
+  tool= request["tool"]
+  path= os.path.join(tools_directory, tool)
+  if os.path.basename(tool) != tool or not os.path.isfile(path):
+    print("unknown tool {}".format(tool), file=sys.stderr)
+    return 2
+  # Run as the client would, though variables read when the modules were
+  # warmed, such as thread counts, keep the server's values.
+  os.chdir(request["cwd"])
+  os.umask(request["umask"])
+  os.environ.clear()
+  os.environ.update(request["environment"])
+  paths= [p for p in os.environ.get("PYTHONPATH", "").split(os.pathsep) if p]
+  sys.path[1:1]= [os.path.abspath(p) for p in paths]
+  sys.argv= [path] + request["argv"]
+  try:
+    runpy.run_path(path, run_name="__main__")
+    exit_code= 0
+  except SystemExit as ex:
+    if ex.code is None or isinstance(ex.code, int):
+      exit_code= ex.code or 0
+    else:
+      print(ex.code, file=sys.stderr)
+      exit_code= 1
+  except BaseException:
+    traceback.print_exc()
+    exit_code= 1
+  for f in (sys.stdout, sys.stderr):
+    try:
+      f.flush()
+    except (OSError, ValueError):
+      pass
+  return exit_code
+
+def submit(socket_path, tool, argv, fds=(0, 1, 2), cwd=None, environment=None):
+  """Runs a job on the server with this process's umask and environment
+    (default os.environ) and returns its exit code.  Raises OSError if the
+    server is not running."""
+  umask= os.umask(0)
+  os.umask(umask)
+  with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+    s.connect(socket_path)
+    request= {"tool": tool, "argv": list(argv), "cwd": cwd or os.getcwd(), "umask": umask,
+      "environment": dict(os.environ if environment is None else environment)}
+    socket.send_fds(s, [json.dumps(request).encode() + b"\n"], list(fds))
+    reply= b""
+    while not reply.endswith(b"\n"):
+      data= s.recv(MAX_MESSAGE_SIZE)
+      if not data:
+        raise ConnectionError("job server closed the connection")
+      reply += data
+  return json.loads(reply)["exit_code"]
+
+def benchmark(job_count=20):
+  # Compare the latency of running a script with a cold start with running it
+  # with the job server, both directly and with the client script.
+  import subprocess
+  import tempfile
+  import time
+  from benchmark import report
+  tools_directory= os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bin")
+  with tempfile.TemporaryDirectory() as directory:
+    socket_path= os.path.join(directory, "socket")
+    input_path= os.path.join(directory, "input.csv")
+    with open(input_path, "w") as fout:
+      for i in range(1000):
+        print("{},{},{}".format(i % 2, i, i * i % 97), file=fout)
+    pid= os.fork()
+    if pid == 0:
+      from signal import signal, SIGTERM
+      signal(SIGTERM, lambda signo, frame: sys.exit(0))
+      try:
+        serve(socket_path, tools_directory, 2)
+      finally:
+        os._exit(0)
+    while not os.path.exists(socket_path):
+      time.sleep(0.01)
+    settings_path= os.path.join(directory, "settings")
+    env= dict(os.environ, JOB_SERVER_SOCKET=socket_path)
+    def time_jobs(fn):
+      fn()
+      start= time.perf_counter()
+      for _ in range(job_count):
+        if fn():
+          raise RuntimeError("job failed")
+      return (time.perf_counter() - start) / job_count
+    def children_rss():
+      import resource
+      return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    try:
+      for tool in ("scale.py", "lor.py"):
+        tool_argv= ["-s", settings_path] if tool == "scale.py" else ["0"]
+        tool_argv += [input_path, os.devnull]
+        elapsed= time_jobs(lambda: subprocess.call([sys.executable, os.path.join(tools_directory, tool)] + tool_argv))
+        report("cold {}".format(tool), elapsed, children_rss(), jobs=job_count)
+        elapsed= time_jobs(lambda: subprocess.call([sys.executable, os.path.join(tools_directory, "job.py"), tool] + tool_argv, env=env))
+        report("client {}".format(tool), elapsed, children_rss(), jobs=job_count)
+        with open(os.devnull, "w") as fout:
+          elapsed= time_jobs(lambda: submit(socket_path, tool, tool_argv, (0, fout.fileno(), 2)))
+        report("submit {}".format(tool), elapsed, children_rss(), jobs=job_count)
+    finally:
+      from signal import SIGTERM
+      os.kill(pid, SIGTERM)
+      os.waitpid(pid, 0)
+
+if __name__ == "__main__":
+  benchmark()
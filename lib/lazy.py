@@ -0,0 +1,18 @@
+import importlib
+
+class LazyModule:
+  """Stands in for a module, importing it when one of its attributes is
+    first used.  A script can bind heavy modules such as NumPy at the top
+    level without importing them for code paths, such as showing its help,
+    that don't use them."""
+  def __init__(self, name):
+    self.__name= name
+
+  def __getattr__(self, attribute):
+    # Copy the module's attributes so later lookups don't come here.
+    module= importlib.import_module(self.__name)
+    self.__dict__.update(module.__dict__)
+    return getattr(module, attribute)
+
+  def __repr__(self):
+    return "<lazy module {!r}>".format(self.__name)
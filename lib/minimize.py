@@ -38,51 +38,108 @@ gradient based optimization using nonlinear conjugate gradients.
 The function is a straightforward Python-translation of Carl Rasmussen's
 Matlab-function minimize.m
 
+It additionally accepts a function returning both the value and the gradient,
+reuses the latest evaluation when asked for the same point again, calls an
+optional callback after each successful line search, and, with full_output,
+returns convergence statistics.
+
+The function 'minimize_batch' minimizes many independent problems at once,
+taking the same steps for each that 'minimize' would.
+
 """
 
 
-from numpy import dot, isinf, isnan, any, sqrt, isreal, real, nan, inf
-
-def minimize(X, f, grad, *args, maxnumlinesearch=None, maxnumfuneval=None, red=1.0, verbose=True):
-    INT = 0.1;# don't reevaluate within 0.1 of the limit of the current bracket
-    EXT = 3.0;              # extrapolate maximum 3 times the current step-size
-    MAX = 20;                     # max 20 function evaluations per line search
-    RATIO = 10;                                   # maximum allowed slope ratio
-    SIG = 0.1;RHO = SIG/2;# SIG and RHO are the constants controlling the Wolfe-
-    #Powell conditions. SIG is the maximum allowed absolute ratio between
-    #previous and new slopes (derivatives in the search direction), thus setting
-    #SIG to low (positive) values forces higher precision in the line-searches.
-    #RHO is the minimum allowed fraction of the expected (from the slope at the
-    #initial point in the linesearch). Constants must satisfy 0 < RHO < SIG < 1.
-    #Tuning of SIG (depending on the nature of the function to be optimized) may
-    #speed up the minimization; it is probably not worth playing much with RHO.
-
-    SMALL = 10.**-16                    #minimize.m uses matlab's realmin 
-    
+import time
+from numpy import array_equal, dot, isinf, isnan, any, sqrt, isreal, real, nan, inf
+
+INT = 0.1;# don't reevaluate within 0.1 of the limit of the current bracket
+EXT = 3.0;              # extrapolate maximum 3 times the current step-size
+MAX = 20;                     # max 20 function evaluations per line search
+RATIO = 10;                                   # maximum allowed slope ratio
+SIG = 0.1;RHO = SIG/2;# SIG and RHO are the constants controlling the Wolfe-
+#Powell conditions. SIG is the maximum allowed absolute ratio between
+#previous and new slopes (derivatives in the search direction), thus setting
+#SIG to low (positive) values forces higher precision in the line-searches.
+#RHO is the minimum allowed fraction of the expected (from the slope at the
+#initial point in the linesearch). Constants must satisfy 0 < RHO < SIG < 1.
+#Tuning of SIG (depending on the nature of the function to be optimized) may
+#speed up the minimization; it is probably not worth playing much with RHO.
+
+SMALL = 10.**-16                    #minimize.m uses matlab's realmin
+
+def run_length(maxnumlinesearch, maxnumfuneval):
     if maxnumlinesearch == None:
         if maxnumfuneval == None:
             raise ValueError("Specify maxnumlinesearch or maxnumfuneval")
         else:
-            S = 'Function evaluation'
-            length = maxnumfuneval
+            return 'Function evaluation', maxnumfuneval
     else:
         if maxnumfuneval != None:
             raise ValueError("Specify either maxnumlinesearch or maxnumfuneval (not both)")
         else: 
-            S = 'Linesearch'
-            length = maxnumlinesearch
+            return 'Linesearch', maxnumlinesearch
+
+class Statistics:
+    """Convergence statistics of a minimization: the numbers of function
+    evaluations (of f or f_and_grad), gradient evaluations, and cache hits,
+    the time in seconds of each line search, the function values after each
+    successful line search (fX), whether the callback stopped it, and the
+    total time in seconds."""
+    def __init__(self):
+        self.function_evaluations = 0
+        self.gradient_evaluations = 0
+        self.cache_hits = 0
+        self.line_search_times = []
+        self.fX = []
+        self.stopped = False
+        self.time = 0.0
+
+    @property
+    def line_searches(self):
+        return len(self.line_search_times)
+
+    def __repr__(self):
+        return ("function_evaluations=%d gradient_evaluations=%d cache_hits=%d line_searches=%d line_search_time=%.6f stopped=%s time=%.6f" %
+            (self.function_evaluations, self.gradient_evaluations, self.cache_hits, self.line_searches, sum(self.line_search_times), self.stopped, self.time))
+
+def minimize(X, f, grad, *args, maxnumlinesearch=None, maxnumfuneval=None, red=1.0, verbose=True, f_and_grad=None, callback=None, full_output=False):
+    """Minimizes f starting at X using its gradient grad, or f_and_grad, which
+    returns both, if given.  The callback, if given, receives X, its value,
+    and its gradient after each successful line search and stops the
+    minimization by returning a true value.  Returns X, the function values
+    fX, and the number of line searches or function evaluations used plus,
+    with full_output, a Statistics object."""
+    start = time.perf_counter()
+    stats = Statistics()
+    cache = []
+    def evaluate(X):
+        # Reuse the latest evaluation if asked for the same point again.
+        if cache and array_equal(cache[0], X):
+            stats.cache_hits += 1
+            return cache[1], cache[2]
+        stats.function_evaluations += 1
+        stats.gradient_evaluations += 1
+        if f_and_grad is None:
+            fX = f(X, *args)
+            dfX = grad(X, *args)
+        else:
+            fX, dfX = f_and_grad(X, *args)
+        cache[:] = X.copy(), fX, dfX
+        return fX, dfX
+
+    S, length = run_length(maxnumlinesearch, maxnumfuneval)
 
     i = 0                                         # zero the run length counter
     ls_failed = 0                          # no previous line search has failed
-    f0 = f(X, *args)                          # get function value and gradient
-    df0 = grad(X, *args)  
-    fX = [f0]
+    f0, df0 = evaluate(X)                     # get function value and gradient
+    fX = stats.fX; fX.append(f0)
     i = i + (length<0)                                         # count epochs?!
     s = -df0; d0 = -dot(s,s)    # initial search direction (steepest) and slope
     x3 = red/(1.0-d0)                             # initial step is red/(|s|+1)
 
     while i < abs(length):                                 # while not finished
         i = i + (length>0)                                 # count iterations?!
+        line_search_start = time.perf_counter()
 
         X0 = X; F0 = f0; dF0 = df0              # make a copy of current values
         if length>0:
@@ -95,8 +152,7 @@ def minimize(X, f, grad, *args, maxnumlinesearch=None, maxnumfuneval=None, red=1
             while (not success) and (M > 0):
                 try:
                     M = M - 1; i = i + (length<0)              # count epochs?!
-                    f3 = f(X+x3*s, *args)
-                    df3 = grad(X+x3*s, *args)
+                    f3, df3 = evaluate(X+x3*s)
                     if isnan(f3) or isinf(f3) or any(isnan(df3)+isinf(df3)):
                         print("error")
                         return
@@ -148,13 +204,13 @@ def minimize(X, f, grad, *args, maxnumlinesearch=None, maxnumfuneval=None, red=1
                 x3 = (x2+x4)/2      # if we had a numerical problem then bisect
             x3 = max(min(x3, x4-INT*(x4-x2)),x2+INT*(x4-x2))  
                                                        # don't accept too close
-            f3 = f(X+x3*s, *args)
-            df3 = grad(X+x3*s, *args)
+            f3, df3 = evaluate(X+x3*s)
             if f3 < F0:
                 X0 = X+x3*s; F0 = f3; dF0 = df3              # keep best values
             M = M - 1; i = i + (length<0)                      # count epochs?!
             d3 = dot(df3,s)                                         # new slope
 
+        stats.line_search_times.append(time.perf_counter() - line_search_start)
         if abs(d3) < -SIG*d0 and f3 < f0+x3*RHO*d0:  # if line search succeeded
             X = X+x3*s; f0 = f3; fX.append(f0)               # update variables
             if verbose: print('%s %6i;  Value %4.6e\r' % (S, i, f0))
@@ -166,6 +222,9 @@ def minimize(X, f, grad, *args, maxnumlinesearch=None, maxnumfuneval=None, red=1
                 s = -df0; d0 = -dot(s,s)     # otherwise use steepest direction
             x3 = x3 * min(RATIO, d3/(d0-SMALL))     # slope ratio but max RATIO
             ls_failed = 0                       # this line search did not fail
+            if callback is not None and callback(X, f0, df0):
+                stats.stopped = True                       # asked to stop early
+                break
         else:
             X = X0; f0 = F0; df0 = dF0              # restore best point so far
             if ls_failed or (i>abs(length)):# line search failed twice in a row
@@ -174,5 +233,193 @@ def minimize(X, f, grad, *args, maxnumlinesearch=None, maxnumfuneval=None, red=1
             x3 = 1/(1-d0)                     
             ls_failed = 1                             # this line search failed
     if verbose: print("\n")
+    stats.time = time.perf_counter() - start
+    if full_output:
+        return X, fX, i, stats
     return X, fX, i
 
+
+# The phases of a row of minimize_batch, following the loops of minimize.
+# Rows in the evaluation phases wait for the next call of f_and_grad.
+DONE, START, EXTRAPOLATE, EXTRAPOLATE_EVAL, EXTRAPOLATED, INTERPOLATE, INTERPOLATE_EVAL, INTERPOLATED, END = range(9)
+
+def minimize_batch(X, f_and_grad, *args, maxnumlinesearch=None, maxnumfuneval=None, red=1.0):
+    """Minimizes B independent problems at once.  X is a B by D array of
+    starting points, and f_and_grad(X, *args) returns the B function values
+    and the B by D gradients of its rows.  Each row takes the same steps
+    minimize would take for it alone, using masks in place of its branches,
+    so each call of f_and_grad serves all rows; rows that have finished stay
+    at their points.  Returns X, a list of the function values fX of each
+    row, an array of the number of line searches or function evaluations
+    each row used, and a mask of the rows for which f_and_grad returned a
+    value or gradient that isn't finite, for which minimize reports an
+    error."""
+    import numpy as np
+    def rowdot(a, b):
+        # Batched matrix multiplication matches dot for each row exactly.
+        return (a[:, None, :] @ b[:, :, None])[:, 0, 0]
+    def square(a):
+        # Unlike **, float_power squares the way minimize does for scalars.
+        return np.float_power(a, 2)
+    def evaluate(X):
+        f, df = f_and_grad(X, *args)
+        return np.array(f, dtype=float), np.array(df, dtype=float)
+    _, length = run_length(maxnumlinesearch, maxnumfuneval)
+    X = np.array(X, dtype=float)
+    B = X.shape[0]
+
+    i = np.zeros(B, dtype=int)
+    ls_failed = np.zeros(B, dtype=bool)
+    failed = np.zeros(B, dtype=bool)
+    f0, df0 = evaluate(X)
+    fX = [[f] for f in f0.tolist()]
+    i += (length<0)
+    s = -df0; d0 = -rowdot(s,s)
+    x3 = red/(1.0-d0)
+    X0 = X.copy(); F0 = f0.copy(); dF0 = df0.copy()
+    x1, f1, d1, x2, f2, d2, f3, d3, x4, f4, d4 = (np.zeros(B) for _ in range(11))
+    df3 = np.zeros_like(df0)
+    M = np.zeros(B, dtype=int)
+    phase = np.full(B, START)
+
+    with np.errstate(all='ignore'):
+        while True:
+            # Advance each row to its next evaluation or until it's done.
+            while True:
+                m = phase == START
+                if m.any():
+                    phase[m & ~(i < abs(length))] = DONE
+                    m &= i < abs(length)
+                    i[m] += (length>0)
+                    X0[m] = X[m]; F0[m] = f0[m]; dF0[m] = df0[m]
+                    M[m] = MAX if length>0 else np.minimum(MAX, -length-i[m])
+                    phase[m] = EXTRAPOLATE
+
+                m = phase == EXTRAPOLATE
+                if m.any():
+                    x2[m] = 0; f2[m] = f0[m]; d2[m] = d0[m]; f3[m] = f0[m]; df3[m] = df0[m]
+                    e = m & (M > 0)
+                    M[e] -= 1; i[e] += (length<0)
+                    phase[e] = EXTRAPOLATE_EVAL
+                    phase[m & ~e] = EXTRAPOLATED
+
+                m = phase == EXTRAPOLATED
+                if m.any():
+                    better = m & (f3 < F0)
+                    X0[better] = X[better]+x3[better,None]*s[better]; F0[better] = f3[better]; dF0[better] = df3[better]
+                    d3[m] = rowdot(df3[m],s[m])
+                    done = m & ((d3 > SIG*d0) | (f3 > f0+x3*RHO*d0) | (M == 0))
+                    phase[done] = INTERPOLATE
+                    m &= ~done
+                    x1[m] = x2[m]; f1[m] = f2[m]; d1[m] = d2[m]
+                    x2[m] = x3[m]; f2[m] = f3[m]; d2[m] = d3[m]
+                    A = 6*(f1[m]-f2[m])+3*(d2[m]+d1[m])*(x2[m]-x1[m])
+                    Bc = 3*(f2[m]-f1[m])-(2*d1[m]+d2[m])*(x2[m]-x1[m])
+                    Z = Bc+np.sqrt((Bc*Bc-A*d1[m]*(x2[m]-x1[m])).astype(complex))
+                    x = np.where(Z != 0.0, x1[m]-d1[m]*square(x2[m]-x1[m])/Z, inf)
+                    limit = x2[m]*EXT
+                    closest = x2[m]+INT*(x2[m]-x1[m])
+                    x = np.where((x.imag != 0) | np.isnan(x) | np.isinf(x) | (x.real < 0), limit,
+                        np.where(x.real > limit, limit, np.where(x.real < closest, closest, x.real)))
+                    x3[m] = x.real
+                    phase[m] = EXTRAPOLATE
+
+                m = phase == INTERPOLATED
+                if m.any():
+                    better = m & (f3 < F0)
+                    X0[better] = X[better]+x3[better,None]*s[better]; F0[better] = f3[better]; dF0[better] = df3[better]
+                    M[m] -= 1; i[m] += (length<0)
+                    d3[m] = rowdot(df3[m],s[m])
+                    phase[m] = INTERPOLATE
+
+                m = phase == INTERPOLATE
+                if m.any():
+                    e = m & ((abs(d3) > -SIG*d0) | (f3 > f0+x3*RHO*d0)) & (M > 0)
+                    phase[m & ~e] = END
+                    m = e
+                    upper = m & ((d3 > 0) | (f3 > f0+x3*RHO*d0))
+                    x4[upper] = x3[upper]; f4[upper] = f3[upper]; d4[upper] = d3[upper]
+                    lower = m & ~upper
+                    x2[lower] = x3[lower]; f2[lower] = f3[lower]; d2[lower] = d3[lower]
+                    q = f4[m] > f0[m]
+                    a, b, c, d = x2[m], f2[m], d2[m], x4[m]
+                    A = 6*(b-f4[m])/(d-a)+3*(d4[m]+c)
+                    Bc = 3*(f4[m]-b)-(2*c+d4[m])*(d-a)
+                    x = np.where(q, a-(0.5*c*square(d-a))/(f4[m]-b-c*(d-a)),
+                        np.where(A != 0, a+(np.sqrt(Bc*Bc-A*c*square(d-a))-Bc)/A, inf))
+                    x = np.where(np.isnan(x) | np.isinf(x), (a+d)/2, x)
+                    x3[m] = np.maximum(np.minimum(x, d-INT*(d-a)), a+INT*(d-a))
+                    phase[m] = INTERPOLATE_EVAL
+
+                m = phase == END
+                if m.any():
+                    success = m & (abs(d3) < -SIG*d0) & (f3 < f0+x3*RHO*d0)
+                    m &= ~success
+                    if success.any():
+                        k = success
+                        X[k] = X[k]+x3[k,None]*s[k]; f0[k] = f3[k]
+                        for row in np.flatnonzero(k).tolist():
+                            fX[row].append(f0[row])
+                        s[k] = ((rowdot(df3[k],df3[k])-rowdot(df0[k],df3[k]))/rowdot(df0[k],df0[k]))[:,None]*s[k] - df3[k]
+                        df0[k] = df3[k]
+                        d3[k] = d0[k]; d0[k] = rowdot(df0[k],s[k])
+                        steepest = k & (d0 > 0)
+                        s[steepest] = -df0[steepest]; d0[steepest] = -rowdot(s[steepest],s[steepest])
+                        ratio = d3[k]/(d0[k]-SMALL)
+                        x3[k] = x3[k] * np.where(ratio < RATIO, ratio, RATIO)
+                        ls_failed[k] = False
+                        phase[k] = START
+                    X[m] = X0[m]; f0[m] = F0[m]; df0[m] = dF0[m]
+                    phase[m & (ls_failed | (i>abs(length)))] = DONE
+                    m &= ~(ls_failed | (i>abs(length)))
+                    s[m] = -df0[m]; d0[m] = -rowdot(s[m],s[m])
+                    x3[m] = 1/(1-d0[m])
+                    ls_failed[m] = True
+                    phase[m] = START
+
+                if not np.isin(phase, (START, EXTRAPOLATE, EXTRAPOLATED, INTERPOLATED, INTERPOLATE, END)).any():
+                    break
+
+            # Evaluate the rows waiting for it at once.
+            waiting = (phase == EXTRAPOLATE_EVAL) | (phase == INTERPOLATE_EVAL)
+            if not waiting.any():
+                break
+            Xt = X.copy()
+            Xt[waiting] = X[waiting]+x3[waiting,None]*s[waiting]
+            f, df = evaluate(Xt)
+            f3[waiting] = f[waiting]; df3[waiting] = df[waiting]
+            m = phase == EXTRAPOLATE_EVAL
+            bad = m & (np.isnan(f3) | np.isinf(f3) | (np.isnan(df3) | np.isinf(df3)).any(1))
+            failed |= bad
+            phase[bad] = DONE
+            phase[m & ~bad] = EXTRAPOLATED
+            phase[phase == INTERPOLATE_EVAL] = INTERPOLATED
+    return X, fX, i, failed
+
+def benchmark(problem_count=1000, row_count=30, column_count=5):
+    # Compare minimizing small logistic regression problems one at a time
+    # with minimizing them as a batch.
+    import numpy as np
+    import timeit
+    rng = np.random.default_rng(1)
+    A = rng.normal(size=(problem_count, row_count, column_count))
+    y = (rng.random((problem_count, row_count)) < 0.5).astype(float)
+    def f_and_grad(X, A, y):
+        p = (A @ X[:, :, None])[:, :, 0]
+        e = 1/(1+np.exp(-p))-y
+        f = np.sum(np.logaddexp(0, p)-y*p, 1)+0.05*(X[:, None, :] @ X[:, :, None])[:, 0, 0]
+        return f, (np.swapaxes(A, 1, 2) @ e[:, :, None])[:, :, 0]+0.1*X
+    X = np.zeros((problem_count, column_count))
+    def one_at_a_time():
+        return [minimize(X[k], None, None, A[k:k+1], y[k:k+1], maxnumlinesearch=50, verbose=False,
+            f_and_grad=lambda x, *args: tuple(v[0] for v in f_and_grad(x[None], *args))) for k in range(problem_count)]
+    def batch():
+        return minimize_batch(X, f_and_grad, A, y, maxnumlinesearch=50)
+    results, (Xb, fXb, ib, _) = one_at_a_time(), batch()
+    assert all(np.array_equal(r[0], Xb[k]) and r[1] == fXb[k] and r[2] == ib[k] for k, r in enumerate(results))
+    for name, fn in [("one at a time", one_at_a_time), ("batch", batch)]:
+        elapsed = min(timeit.repeat(fn, number=1, repeat=3))
+        print("%-14s %8.0f problems/s" % (name, problem_count / elapsed))
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+"""Runs shell command lines concurrently with a bounded pool of asyncio
+  subprocesses, starting the next command as soon as one finishes."""
+
+import asyncio
+import os
+import sys
+import time
+
+class Job:
+  """The result of running a command:  its index in the input, exit code,
+    start time relative to the start of the run, and elapsed time."""
+  def __init__(self, index, command):
+    self.index= index
+    self.command= command
+    self.exit_code= None
+    self.start= None
+    self.elapsed= None
+    self.output= None
+
+  def __repr__(self):
+    return "Job({}, {!r}, exit_code={}, elapsed={:.3f})".format(self.index, self.command, self.exit_code, self.elapsed or 0)
+
+async def run_commands(commands, limit=None, shell="/bin/sh", wants_ordered=False, output_file=None, on_done=None):
+  """Runs the commands with at most limit (default the number of CPUs) at a
+    time and returns a list of their jobs in input order.  The commands read
+    standard input from /dev/null and inherit standard output unless
+    wants_ordered is true, in which case it writes the output of each to
+    output_file (default standard output) in input order.  It calls on_done
+    with each job as it finishes."""
+  limit= limit if limit and limit > 0 else os.cpu_count() or 1
+  output_file= output_file or sys.stdout.buffer
+  commands= iter(enumerate(commands))
+  jobs= []
+  pending= {}
+  next_index= 0
+  run_start= time.perf_counter()
+
+  def write_ready():
+    # Write the output of the finished jobs that are next in order.
+    nonlocal next_index
+    while next_index in pending:
+      job= pending.pop(next_index)
+      output_file.write(job.output)
+      job.output= None
+      next_index += 1
+    output_file.flush()
+
+  async def work():
+    for index, command in commands:
+      job= Job(index, command)
+      jobs.append(job)
+      job.start= time.perf_counter() - run_start
+      stdout= asyncio.subprocess.PIPE if wants_ordered else None
+      # Don't let a command read the commands after it from a shared standard
+      # input.
+      process= await asyncio.create_subprocess_exec(shell, "-c", command, stdin=asyncio.subprocess.DEVNULL, stdout=stdout)
+      job.output, _= await process.communicate()
+      job.exit_code= process.returncode
+      job.elapsed= time.perf_counter() - run_start - job.start
+      if wants_ordered:
+        pending[index]= job
+        write_ready()
+      if on_done:
+        on_done(job)
+
+  await asyncio.gather(*(work() for _ in range(limit)))
+  return sorted(jobs, key=lambda job: job.index)
+
+def run(commands, limit=None, shell="/bin/sh", wants_ordered=False, output_file=None, on_done=None):
+  """Runs the commands as run_commands does outside of an event loop."""
+  return asyncio.run(run_commands(commands, limit, shell, wants_ordered, output_file, on_done))
+
+def benchmark(job_count=200, procon_job_count=10):
+  # Compare running short commands with the pool with running them with
+  # procon, which polls for finished commands every half second.
+  import subprocess
+  from benchmark import measure, report
+  procon= os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bin", "procon")
+  limit= os.cpu_count() or 1
+  def run_pool(count, wants_ordered):
+    with open(os.devnull, "wb") as fout:
+      os.dup2(fout.fileno(), 1)
+      run(("sleep 0.01; echo %d" % i for i in range(count)), limit, wants_ordered=wants_ordered, output_file=fout)
+  def run_procon(count):
+    commands= "".join("sleep 0.01; echo %d\n" % i for i in range(count)).encode()
+    subprocess.run([procon, str(limit)], input=commands, stdout=subprocess.DEVNULL, check=True)
+  for name, fn, args, count in [
+      ("pool", run_pool, (job_count, False), job_count),
+      ("pool (ordered)", run_pool, (job_count, True), job_count),
+      ("procon", run_procon, (procon_job_count,), procon_job_count)]:
+    elapsed, peak_rss= measure(fn, *args)
+    report(name, elapsed, peak_rss, jobs=count, jobs_per_second=int(count / elapsed))
+
+if __name__ == "__main__":
+  benchmark()
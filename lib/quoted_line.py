@@ -1,6 +1,80 @@
 #!/usr/bin/env python3
 
 def parse(line, delimiter):
+  if isinstance(line, str):
+    quote = '"'
+  else:
+    line = bytes(line)
+    quote = b'"'
+    if isinstance(delimiter, str):
+      delimiter = delimiter.encode()
+  line = line.strip()
+  if quote not in delimiter and quote in line:
+    # Segments alternate between outside and inside quotes.  Only split the
+    # outside ones; the inside ones continue the current part.
+    parts = [line[:0]]
+    for i, segment in enumerate(line.split(quote)):
+      if i % 2:
+        parts[-1] += segment
+      else:
+        pieces = segment.split(delimiter)
+        parts[-1] += pieces[0]
+        parts.extend(pieces[1:])
+    return parts
+  else:
+    return line.split(delimiter)
+
+def records(buffer, delimiter):
+  """Parses each line of a string, bytes, or memoryview buffer into parts.  A
+    line with an unclosed quote continues onto the next line."""
+  if isinstance(buffer, memoryview):
+    buffer = buffer.tobytes()
+  if isinstance(buffer, (bytes, bytearray)):
+    quote, newline = b'"', b'\n'
+    if isinstance(delimiter, str):
+      delimiter = delimiter.encode()
+  else:
+    quote, newline = '"', '\n'
+  lines = buffer.split(newline)
+  if not lines[-1]:
+    lines.pop()
+  if quote in delimiter or quote not in buffer:
+    for line in lines:
+      yield line.strip().split(delimiter)
+    return
+  record = None
+  for line in lines:
+    if record is not None:
+      line = record + newline + line
+    if line.count(quote) % 2:
+      record = line
+    else:
+      record = None
+      yield parse(line, delimiter)
+  if record is not None:
+    yield parse(record, delimiter)
+
+def read_chunks(input_file, chunk_size):
+  """Reads a binary file in chunks of at least chunk_size bytes, yielding
+    the whole lines of each and carrying a partial last line into the next.
+    The last chunk may lack a final newline."""
+  rest = b""
+  while True:
+    chunk = input_file.read(chunk_size)
+    if not chunk:
+      break
+    chunk = rest + chunk
+    i = chunk.rfind(b'\n') + 1
+    if i:
+      rest = chunk[i:]
+      yield chunk[:i]
+    else:
+      rest = chunk
+  if rest:
+    yield rest
+
+def parse_by_character(line, delimiter):
+  # This is the original implementation, kept for comparison.
   line = line.strip()
   if '"' not in delimiter and '"' in line:
     in_quotes = False
@@ -24,3 +98,24 @@ def parse(line, delimiter):
     return parts
   else:
     return line.split(delimiter)
+
+def benchmark(line_count=20000):
+  import random
+  import timeit
+  random.seed(1)
+  def make_field(quoted):
+    s = "".join(random.choice("abcdefgh ,") for _ in range(random.randint(5, 80)))
+    return '"%s"' % s if quoted else s.replace(',', ';')
+  for name, quoted in [("unquoted", False), ("quoted", True)]:
+    lines = [",".join(make_field(quoted and i % 2) for i in range(12)) + "\n" for _ in range(line_count)]
+    assert all(parse(line, ',') == parse_by_character(line, ',') for line in lines)
+    buffer = "".join(lines).encode()
+    for fn_name, fn in [
+        ("by character", lambda: [parse_by_character(line, ',') for line in lines]),
+        ("parse", lambda: [parse(line, ',') for line in lines]),
+        ("records (bytes)", lambda: list(records(buffer, ',')))]:
+      elapsed = min(timeit.repeat(fn, number=1, repeat=3))
+      print("%-10s %-16s %8.0f lines/s" % (name, fn_name, line_count / elapsed))
+
+if __name__ == "__main__":
+  benchmark()
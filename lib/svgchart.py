@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+"""Writes line and bar charts as SVG directly, without building a tree of
+  objects for every point, for charts too large for pygal."""
+
+import math
+from xml.sax.saxutils import escape
+
+WIDTH= 800
+HEIGHT= 600
+COLORS= ("#F44336", "#3F51B5", "#009688", "#FFC107", "#FF5722", "#9C27B0",
+  "#03A9F4", "#8BC34A", "#FF9800", "#E91E63", "#2196F3", "#4CAF50",
+  "#FFEB3B", "#673AB7", "#00BCD4", "#CDDC39", "#9E9E9E", "#607D8B")
+MAX_X_LABELS= 20
+CHUNK_POINTS= 1 << 16
+
+class Frame:
+  """Lays out the title, legend, axes, and plot area of a chart and maps
+    values to coordinates."""
+  def __init__(self, names, low, high, title, show_legend, width, height):
+    self.width= width
+    self.height= height
+    self.left= 60.0
+    self.right= width - 20.0
+    self.top= 50.0 if title else 20.0
+    legend_rows= math.ceil(len(names) / 4) if show_legend else 0
+    self.bottom= height - 40.0 - 20.0 * legend_rows
+    if not low < high:
+      low, high= low - 1, high + 1
+    self.ticks= nice_ticks(low, high)
+    self.low= min(low, self.ticks[0])
+    self.high= max(high, self.ticks[-1])
+
+  def y(self, values):
+    """Maps an array of values to Y coordinates."""
+    return self.bottom - (values - self.low) * ((self.bottom - self.top) / (self.high - self.low))
+
+  def write_start(self, output_file, names, title, show_legend):
+    output_file.write('<?xml version="1.0" encoding="utf-8"?>\n'
+      '<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" viewBox="0 0 %d %d" font-family="sans-serif" font-size="12">\n'
+      '<rect width="100%%" height="100%%" fill="white"/>\n' % (self.width, self.height, self.width, self.height))
+    if title:
+      output_file.write('<text x="%.1f" y="30" text-anchor="middle" font-size="16">%s</text>\n' % (self.width / 2, escape(title)))
+    for tick in self.ticks:
+      y= self.y(tick)
+      output_file.write('<line x1="%.1f" y1="%.1f" x2="%.1f" y2="%.1f" stroke="#ddd"/>'
+        '<text x="%.1f" y="%.1f" text-anchor="end">%s</text>\n' % (self.left, y, self.right, y, self.left - 5, y + 4, "%g" % tick))
+    if show_legend:
+      for i, name in enumerate(names):
+        x= self.left + (i % 4) * (self.right - self.left) / 4
+        y= self.bottom + 45 + 20 * (i // 4)
+        output_file.write('<rect x="%.1f" y="%.1f" width="12" height="12" fill="%s"/><text x="%.1f" y="%.1f">%s</text>\n' %
+          (x, y - 10, color(i), x + 16, y, escape(str(name))))
+
+  def write_x_labels(self, output_file, x_labels, xs):
+    # Write at most MAX_X_LABELS evenly spaced labels.
+    step= max(1, math.ceil(len(x_labels) / MAX_X_LABELS))
+    for i in range(0, len(x_labels), step):
+      output_file.write('<text x="%.1f" y="%.1f" text-anchor="middle">%s</text>\n' % (xs[i], self.bottom + 18, escape(str(x_labels[i]))))
+
+  def write_end(self, output_file):
+    output_file.write('<line x1="%.1f" y1="%.1f" x2="%.1f" y2="%.1f" stroke="black"/>\n</svg>\n' % (self.left, self.bottom, self.right, self.bottom))
+
+def color(i):
+  return COLORS[i % len(COLORS)]
+
+def nice_ticks(low, high, count=5):
+  """Returns round tick values covering low to high."""
+  step= (high - low) / count
+  magnitude= 10 ** math.floor(math.log10(step))
+  step= next(m * magnitude for m in (1, 2, 5, 10) if m * magnitude >= step)
+  first= math.floor(low / step)
+  last= math.ceil(high / step)
+  return [i * step for i in range(first, last + 1)]
+
+def as_arrays(series):
+  import numpy as np
+  return [np.array(s, dtype=float) for s in series]
+
+def line_chart(output_file, names, series, title=None, x_labels=None, width=WIDTH, height=HEIGHT):
+  """Writes a line chart of each series with its name in the legend.
+    Missing (None or NaN) values break the line."""
+  import numpy as np
+  series= as_arrays(series)
+  n= max(map(len, series), default=0)
+  finite= [s[np.isfinite(s)] for s in series]
+  low= min((s.min() for s in finite if len(s)), default=0.0)
+  high= max((s.max() for s in finite if len(s)), default=1.0)
+  frame= Frame(names, low, high, title, True, width, height)
+  frame.write_start(output_file, names, title, True)
+  xs= frame.left + np.arange(n) * ((frame.right - frame.left) / max(n - 1, 1))
+  if x_labels is not None:
+    frame.write_x_labels(output_file, x_labels, xs)
+  for i, s in enumerate(series):
+    # Start a new subpath after each missing value.
+    ys= frame.y(s)
+    is_present= np.isfinite(ys)
+    commands= np.where(np.concatenate(([True], ~is_present[:-1])), "M", "L")[is_present]
+    points= np.flatnonzero(is_present)
+    output_file.write('<path fill="none" stroke="%s" stroke-width="1.5" d="' % color(i))
+    for j in range(0, len(points), CHUNK_POINTS):
+      k= points[j:j + CHUNK_POINTS]
+      c= commands[j:j + CHUNK_POINTS]
+      values= np.empty(3 * len(k), dtype=object)
+      values[0::3]= c.tolist()
+      values[1::3]= xs[k].round(1).tolist()
+      values[2::3]= ys[k].round(1).tolist()
+      output_file.write("%s%g,%g" * len(k) % tuple(values))
+    output_file.write('"/>\n')
+  frame.write_end(output_file)
+
+def bar_chart(output_file, names, series, title=None, x_labels=None, wants_stacked=False, show_legend=True, width=WIDTH, height=HEIGHT):
+  """Writes a bar chart with a bar for each series at each X position, side
+    by side or stacked.  Missing values have no bar."""
+  import numpy as np
+  series= as_arrays(series)
+  n= max(map(len, series), default=0)
+  a= np.full((len(series), n), np.nan)
+  for i, s in enumerate(series):
+    a[i, :len(s)]= s
+  values= np.nan_to_num(a)
+  if wants_stacked:
+    # Stack positive values up and negative values down from zero.
+    tops= np.cumsum(np.maximum(values, 0), 0)
+    bottoms= np.cumsum(np.minimum(values, 0), 0)
+    starts= np.where(values >= 0, tops - np.maximum(values, 0), bottoms - np.minimum(values, 0))
+    ends= starts + values
+  else:
+    starts= np.zeros_like(values)
+    ends= values
+  low= min(0.0, starts.min(initial=0.0), ends.min(initial=0.0))
+  high= max(0.0, starts.max(initial=0.0), ends.max(initial=0.0))
+  frame= Frame(names, low, high, title, show_legend, width, height)
+  frame.write_start(output_file, names, title, show_legend)
+  group= (frame.right - frame.left) / max(n, 1)
+  xs= frame.left + (np.arange(n) + 0.5) * group
+  if x_labels is not None:
+    frame.write_x_labels(output_file, x_labels, xs)
+  bar= group * 0.8 / (1 if wants_stacked else max(len(series), 1))
+  for i in range(len(series)):
+    lefts= xs - group * 0.4 + (0 if wants_stacked else i * bar)
+    y1= frame.y(starts[i])
+    y2= frame.y(ends[i])
+    k= np.flatnonzero(np.isfinite(a[i]))
+    fields= np.empty(4 * len(k), dtype=object)
+    fields[0::4]= lefts[k].round(1).tolist()
+    fields[1::4]= np.minimum(y1, y2)[k].round(1).tolist()
+    fields[2::4]= [round(bar, 1)] * len(k)
+    fields[3::4]= np.abs(y2 - y1)[k].round(1).tolist()
+    output_file.write('<g fill="%s">\n' % color(i))
+    output_file.write('<rect x="%g" y="%g" width="%g" height="%g"/>\n' * len(k) % tuple(fields))
+    output_file.write('</g>\n')
+  frame.write_end(output_file)
+
+def benchmark(point_counts=(1000, 10000, 100000), series_count=3):
+  # Compare writing line and bar charts directly with rendering them with
+  # pygal, if it is installed.
+  import os
+  import sys
+  import numpy as np
+  from benchmark import measure, report
+  rng= np.random.default_rng(1)
+  try:
+    import pygal
+  except ImportError:
+    pygal= None
+    print("pygal is not installed; timing only the direct renderer", file=sys.stderr)
+  def direct(kind, series):
+    with open(os.devnull, 'w') as fout:
+      names= ["S%d" % i for i in range(len(series))]
+      if kind == "line":
+        line_chart(fout, names, series, "Title", list(range(len(series[0]))))
+      else:
+        bar_chart(fout, names, series, "Title", list(range(len(series[0]))))
+  def with_pygal(kind, series):
+    c= pygal.Line(show_dots=False) if kind == "line" else pygal.Bar()
+    c.title= "Title"
+    c.x_labels= list(range(len(series[0])))
+    for i, s in enumerate(series):
+      c.add("S%d" % i, s.tolist())
+    with open(os.devnull, 'w') as fout:
+      fout.write(c.render().decode())
+  for kind in ("line", "bar"):
+    for n in point_counts:
+      if kind == "bar" and n > 10000:
+        continue
+      series= list(np.cumsum(rng.normal(size=(series_count, n)), 1))
+      for name, fn in [("direct", direct), ("pygal", with_pygal)]:
+        if fn is with_pygal and pygal is None:
+          continue
+        elapsed, peak_rss= measure(fn, kind, series)
+        report("%s %s %d" % (name, kind, n), elapsed, peak_rss, points=n * series_count)
+
+if __name__ == "__main__":
+  benchmark()
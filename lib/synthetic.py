@@ -0,0 +1,51 @@
+"""Generates seeded synthetic datasets for benchmarks.  The same parameters
+  always produce the same bytes."""
+
+def make_table(row_count, column_count, seed, sparsity=0.0):
+  """Returns features rounded to four places, with about the sparsity
+    fraction of them zero, and binary targets from a logistic model."""
+  import numpy as np
+  rng= np.random.default_rng(seed)
+  x= np.round(rng.normal(size=(row_count, column_count)), 4)
+  if sparsity:
+    x[rng.random((row_count, column_count)) < sparsity]= 0
+  w= rng.normal(size=column_count)
+  y= (x @ w + rng.logistic(size=row_count) > 0).astype(int)
+  return x, y
+
+def write_csv(output_file, x, y, seed, quoting=0.0, coding=0.0):
+  """Writes CSV lines of the features followed by the target.  About the
+    quoting fraction of lines have one quoted value and about the coding
+    fraction of values are erf-coded as p or n followed by their magnitude,
+    as scale.py reads them."""
+  import numpy as np
+  rng= np.random.default_rng(seed)
+  cells= np.char.mod("%g", x).astype(object)
+  if coding:
+    coded= rng.random(x.shape) < coding
+    cells[coded]= ["%s%g" % ("p" if v >= 0 else "n", abs(v)) for v in x[coded]]
+  if quoting:
+    rows= np.flatnonzero(rng.random(len(x)) < quoting)
+    columns= rng.integers(0, x.shape[1], len(rows))
+    cells[rows, columns]= ['"%s"' % s for s in cells[rows, columns]]
+  for row, target in zip(cells.tolist(), y.tolist()):
+    output_file.write(",".join(row) + ",%d\n" % target)
+
+def write_svm(output_file, x, y):
+  """Writes LIBSVM lines of the target followed by the nonzero features."""
+  import numpy as np
+  for row, target in zip(x, y.tolist()):
+    indices= np.flatnonzero(row)
+    pairs= np.empty(2 * len(indices), dtype=object)
+    pairs[0::2]= (indices + 1).tolist()
+    pairs[1::2]= row[indices].tolist()
+    output_file.write(str(target) + " %d:%g" * len(indices) % tuple(pairs) + "\n")
+
+def write_dataset(path, kind, row_count, column_count, seed, sparsity=0.0, quoting=0.0, coding=0.0):
+  """Writes a CSV or LIBSVM (kind "svm") dataset to path."""
+  x, y= make_table(row_count, column_count, seed, sparsity)
+  with open(path, "w") as fout:
+    if kind == "svm":
+      write_svm(fout, x, y)
+    else:
+      write_csv(fout, x, y, seed, quoting, coding)